@@ -0,0 +1,239 @@
+import json
+import os
+import time
+import logging
+from dataclasses import dataclass, asdict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PROFILES_DIR = os.path.join(os.path.dirname(__file__), "profiles")
+
+def profile_path(unit_name: str) -> str:
+    return os.path.join(PROFILES_DIR, f"{unit_name}.json")
+
+@dataclass
+class AxisModel:
+    """
+    Delay + first order model of one gimbal axis:
+        measured(s) / commanded(s) = gain * exp(-delay_s * s) / (time_constant_s * s + 1)
+    with the output speed limited to slew_rate_dps.
+    """
+    gain: float
+    time_constant_s: float
+    delay_s: float
+    slew_rate_dps: float
+    rms_error_deg: float
+
+@dataclass
+class TrackingProfile:
+    """
+    Result of an auto-tune session, loaded by Tracking at startup.
+
+    k_p_* are in degrees per pixel of image error, the same unit as Tracking's k_p.
+    """
+    k_p_tilt: float
+    k_p_pan: float
+    tilt: AxisModel
+    pan: AxisModel
+    settling_time_s: float
+    created_at: float
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(asdict(self), f, indent=2)
+
+    @staticmethod
+    def load(path: str) -> "TrackingProfile":
+        with open(path) as f:
+            d = json.load(f)
+        d["tilt"] = AxisModel(**d["tilt"])
+        d["pan"] = AxisModel(**d["pan"])
+        return TrackingProfile(**d)
+
+# ── Excitation ─────────────────────────────────────────────────────────────────
+def excitation_signal(t: np.ndarray, center: float, amplitude: float,
+                      step_period_s: float = 1.5, n_steps: int = 4,
+                      chirp_f0: float = 0.2, chirp_f1: float = 3.0, chirp_duration_s: float = 6.0) -> np.ndarray:
+    """
+    Commanded angle over time: a sequence of alternating steps around center followed by a
+    linear chirp from chirp_f0 to chirp_f1 Hz. Returns center once the excitation is over.
+    """
+    t = np.asarray(t, dtype=float)
+    steps_end = step_period_s * n_steps
+    out = np.full_like(t, center)
+
+    in_steps = t < steps_end
+    sign = np.where(np.floor(t[in_steps] / step_period_s) % 2 == 0, 1.0, -1.0)
+    out[in_steps] = center + amplitude * sign
+
+    tc = t - steps_end
+    in_chirp = (tc >= 0) & (tc < chirp_duration_s)
+    k = (chirp_f1 - chirp_f0) / chirp_duration_s
+    phase = 2 * np.pi * (chirp_f0 * tc[in_chirp] + 0.5 * k * tc[in_chirp] ** 2)
+    out[in_chirp] = center + amplitude * np.sin(phase)
+
+    return out
+
+def excitation_duration(step_period_s: float = 1.5, n_steps: int = 4, chirp_duration_s: float = 6.0) -> float:
+    # the extra second lets the last part of the chirp settle
+    return step_period_s * n_steps + chirp_duration_s + 1.0
+
+# ── Identification ─────────────────────────────────────────────────────────────
+def resample(t: np.ndarray, values: np.ndarray, sample_time_s: float) -> tuple[np.ndarray, np.ndarray]:
+    """Interpolate irregularly sampled values onto a uniform time grid."""
+    grid = np.arange(t[0], t[-1], sample_time_s)
+    return grid, np.interp(grid, t, values)
+
+def identify_axis(t: np.ndarray, commanded: np.ndarray, measured: np.ndarray,
+                  sample_time_s: float = 0.01, max_delay_s: float = 0.3) -> AxisModel:
+    """
+    Fit a delay + first order model to a logged step/chirp response.
+
+    The model is identified in discrete time as
+        y[k+1] = a * y[k] + b * u[k - d]
+    by solving the least squares problem for every candidate delay d at once and keeping
+    the delay with the smallest residual.
+    """
+    _, u = resample(t, commanded, sample_time_s)
+    _, y = resample(t, measured, sample_time_s)
+
+    max_d = int(round(max_delay_s / sample_time_s))
+    n = len(y) - 1 - max_d
+    if n < 10:
+        raise ValueError("Not enough samples to identify the axis")
+
+    y_next = y[max_d + 1:]  # (n,)
+    y_now = y[max_d:-1]  # (n,)
+    # u_lag[d] = u[k - d] aligned with y_now, for every delay d
+    windows = np.lib.stride_tricks.sliding_window_view(u[:-1], n)  # (max_d + 1, n)
+    u_lag = windows[::-1]
+
+    # batched 2x2 normal equations, one per delay
+    syy = np.dot(y_now, y_now)
+    syu = u_lag @ y_now
+    suu = np.einsum("dn,dn->d", u_lag, u_lag)
+    sy_next_y = np.dot(y_now, y_next)
+    sy_next_u = u_lag @ y_next
+
+    ata = np.empty((max_d + 1, 2, 2))
+    ata[:, 0, 0] = syy
+    ata[:, 0, 1] = syu
+    ata[:, 1, 0] = syu
+    ata[:, 1, 1] = suu
+    atb = np.stack([np.full(max_d + 1, sy_next_y), sy_next_u], axis=1)
+    theta = np.linalg.solve(ata + 1e-9 * np.eye(2), atb[..., None])[..., 0]  # (max_d + 1, 2)
+
+    pred = theta[:, 0:1] * y_now + theta[:, 1:2] * u_lag
+    sse = np.sum((pred - y_next) ** 2, axis=1)
+    d = int(np.argmin(sse))
+    a, b = theta[d]
+
+    a = float(np.clip(a, 1e-6, 1 - 1e-6))
+    slew = np.abs(np.diff(y)) / sample_time_s
+
+    return AxisModel(
+        gain=float(b / (1 - a)),
+        time_constant_s=float(-sample_time_s / np.log(a)),
+        delay_s=d * sample_time_s,
+        slew_rate_dps=float(np.percentile(slew, 98)),
+        rms_error_deg=float(np.sqrt(sse[d] / n)),
+    )
+
+def compute_gain(model: AxisModel, deg_per_px: float, update_rate_hz: float,
+                 settling_time_s: float, pipeline_latency_s: float) -> float:
+    """
+    Tracking adds k_p * error_px to the gimbal angle on every detection, which is an integral
+    controller with gain k_p / deg_per_px * update_rate_hz (1/s) on the angular error.
+
+    With lambda tuning, the closed loop behaves like a first order system with time constant
+    lambda, so it settles (2%) after about 4 * lambda. Latency of the camera and detector adds
+    to the delay of the gimbal itself.
+    """
+    lam = settling_time_s / 4.0
+    dead_time = model.delay_s + model.time_constant_s + pipeline_latency_s
+    k_i = 1.0 / (max(model.gain, 1e-3) * (lam + dead_time))
+    # fraction of the error corrected per detection; more than that overshoots
+    fraction = min(1.0, k_i / update_rate_hz)
+    return fraction * deg_per_px
+
+# ── Session ────────────────────────────────────────────────────────────────────
+class AutoTuner:
+    """
+    Drives a gimbal through step and chirp excitations on each axis, logs the commanded and
+    measured angles and fits a TrackingProfile for the given camera geometry.
+    """
+
+    def __init__(self, gimbal, width: int, height: int, hfov_deg: float,
+                 settling_time_s: float = 0.5, update_rate_hz: float = 60.0,
+                 pipeline_latency_s: float = 0.05, sample_rate_hz: float = 50.0):
+        self._gimbal = gimbal
+        self._width = width
+        self._height = height
+        self._deg_per_px = hfov_deg / max(width, height)
+        self._settling_time_s = settling_time_s
+        self._update_rate_hz = update_rate_hz
+        self._pipeline_latency_s = pipeline_latency_s
+        self._sample_time_s = 1.0 / sample_rate_hz
+
+    def _run_axis(self, axis: str, center: float, amplitude: float, other: float,
+                  stop_event=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        duration = excitation_duration()
+        ts, commanded, measured = [], [], []
+
+        start = time.monotonic()
+        while True:
+            if stop_event is not None and stop_event.is_set():
+                raise RuntimeError("Auto-tune cancelled")
+
+            t = time.monotonic() - start
+            if t > duration:
+                break
+
+            u = float(excitation_signal(np.array([t]), center, amplitude)[0])
+            if axis == "tilt":
+                self._gimbal.move_deg(u, other)
+            else:
+                self._gimbal.move_deg(other, u)
+
+            tilt, pan = self._gimbal.measure_deg()
+            ts.append(time.monotonic() - start)
+            commanded.append(u)
+            measured.append(tilt if axis == "tilt" else pan)
+
+            time.sleep(max(0.0, self._sample_time_s - (time.monotonic() - start - t)))
+
+        return np.array(ts), np.array(commanded), np.array(measured)
+
+    def fit(self, tilt_log, pan_log) -> TrackingProfile:
+        tilt_model = identify_axis(*tilt_log)
+        pan_model = identify_axis(*pan_log)
+        args = (self._deg_per_px, self._update_rate_hz, self._settling_time_s, self._pipeline_latency_s)
+        return TrackingProfile(
+            k_p_tilt=compute_gain(tilt_model, *args),
+            k_p_pan=compute_gain(pan_model, *args),
+            tilt=tilt_model,
+            pan=pan_model,
+            settling_time_s=self._settling_time_s,
+            created_at=time.time(),
+        )
+
+    def run(self, stop_event=None) -> TrackingProfile:
+        logger.info("Auto-tune: exciting tilt axis")
+        tilt_log = self._run_axis("tilt", center=30.0, amplitude=10.0, other=0.0, stop_event=stop_event)
+        logger.info("Auto-tune: exciting pan axis")
+        pan_log = self._run_axis("pan", center=0.0, amplitude=15.0, other=30.0, stop_event=stop_event)
+
+        start = time.perf_counter()
+        profile = self.fit(tilt_log, pan_log)
+        logger.info("Auto-tune: fitted in %.1f ms: %s", (time.perf_counter() - start) * 1000, profile)
+        return profile
+
+if __name__ == "__main__":
+    from gimbal import EmulatedGimbal
+
+    logging.basicConfig(level=logging.INFO)
+    tuner = AutoTuner(EmulatedGimbal(slew_rate_dps=120.0), width=1080, height=1920, hfov_deg=60.0)
+    print(tuner.run())
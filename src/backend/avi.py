@@ -0,0 +1,120 @@
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+class AviMjpegReader:
+    """
+    Random access to the JPEG frames of an MJPEG-in-AVI file, as written by avimux.
+
+    The frame index is built by walking the RIFF chunk headers rather than from idx1, because
+    recordings that were cut short (e.g. the cv process was killed) have no idx1, and large
+    recordings continue in AVIX extension chunks. Only the 8 byte chunk headers are read, so
+    indexing an hour of video takes a fraction of a second.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.indexed_at = time.monotonic()
+        self.fps = 60.0
+        self._offsets: list[int] = []
+        self._sizes: list[int] = []
+        self._lock = threading.Lock()
+        self._f = open(path, "rb")
+        self._index()
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def frame_count(self) -> int:
+        return len(self._offsets)
+
+    @property
+    def duration_s(self) -> float:
+        return self.frame_count / self.fps
+
+    def frame(self, index: int) -> bytes:
+        """JPEG data of frame index (clamped to the available frames)."""
+        if not self._offsets:
+            raise ValueError(f"{self.path} has no frames")
+        index = max(0, min(self.frame_count - 1, index))
+        with self._lock:
+            self._f.seek(self._offsets[index])
+            return self._f.read(self._sizes[index])
+
+    def frame_index(self, t_s: float) -> int:
+        return max(0, min(self.frame_count - 1, int(t_s * self.fps)))
+
+    def frame_at(self, t_s: float) -> bytes:
+        return self.frame(self.frame_index(t_s))
+
+    def _index(self):
+        f = self._f
+        file_size = os.fstat(f.fileno()).st_size
+        self._walk(0, file_size, file_size)
+
+    def _walk(self, start: int, end: int, file_size: int):
+        f = self._f
+        pos = start
+        while pos + 8 <= end:
+            f.seek(pos)
+            header = f.read(12)
+            if len(header) < 8:
+                return
+            fourcc, size = struct.unpack("<4sI", header[:8])
+            data_start = pos + 8
+            # sizes of chunks that were still being written are 0 or past the end of the file
+            data_end = data_start + size if 0 < size <= file_size - data_start else end
+
+            if fourcc in (b"RIFF", b"LIST"):
+                list_type = header[8:12]
+                if list_type in (b"AVI ", b"AVIX", b"movi", b"hdrl"):
+                    self._walk(data_start + 4, data_end, file_size)
+            elif fourcc == b"avih" and len(header) == 12:
+                micro_sec_per_frame = struct.unpack("<I", header[8:12])[0]
+                if micro_sec_per_frame:
+                    self.fps = 1e6 / micro_sec_per_frame
+            elif fourcc[2:] in (b"dc", b"db") and 0 < size <= file_size - data_start:
+                self._offsets.append(data_start)
+                self._sizes.append(size)
+
+            # chunks are padded to an even size
+            pos = data_end + (size & 1)
+
+class AviReaderCache:
+    """
+    Keeps recently used readers (and their frame indexes) open, re-indexing files that changed.
+    Files that are still being recorded are re-indexed at most every reindex_interval_s.
+    """
+
+    def __init__(self, max_open: int = 8, reindex_interval_s: float = 5.0):
+        self._max_open = max_open
+        self._reindex_interval_s = reindex_interval_s
+        self._lock = threading.Lock()
+        self._readers: "OrderedDict[str, AviMjpegReader]" = OrderedDict()
+
+    def get(self, path: str) -> AviMjpegReader:
+        with self._lock:
+            reader = self._readers.get(path)
+            if reader is not None and (reader.mtime == os.path.getmtime(path)
+                                       or time.monotonic() - reader.indexed_at < self._reindex_interval_s):
+                self._readers.move_to_end(path)
+                return reader
+            if reader is not None:
+                reader.close()
+
+            reader = AviMjpegReader(path)
+            self._readers[path] = reader
+            while len(self._readers) > self._max_open:
+                _, old = self._readers.popitem(last=False)
+                old.close()
+            return reader
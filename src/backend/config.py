@@ -0,0 +1,111 @@
+import json
+import os
+import logging
+from dataclasses import dataclass, asdict, fields
+
+logger = logging.getLogger(__name__)
+
+# path of the unit configuration file, relative to this directory unless absolute
+UNITS_CONFIG_PATH = os.environ.get("ROCAM_UNITS", os.path.join(os.path.dirname(__file__), "units.json"))
+
+@dataclass
+class UnitConfig:
+    """
+    One camera + gimbal pair.
+
+    camera:      v4l2 device (e.g. "/dev/video0"), or "synthetic" for a videotestsrc
+    gimbal_port: serial port of the gimbal (e.g. "/dev/ttyTHS1"), or "emulated"
+    ipc_port:    port of the detection IPC channel (cv process -> backend)
+    preview_port: port of the MJPEG preview stream (cv process -> backend), when not using shared memory
+    preview_transport: "shm" (shared memory ring, falls back to TCP if it can't be opened) or "tcp"
+    h264_preview: also stream a low bitrate H.264 preview (fragmented MP4, for browsers with MSE)
+    h264_port:   port of the H.264 preview stream (cv process -> backend)
+    h264_bitrate_kbps / h264_keyframe_interval: encoder settings; viewers join at keyframes
+    h264_encoder: "auto" (hardware encoder if available), "hw" (nvv4l2h264enc) or "sw" (x264enc)
+    recording_mode: "continuous" (one recording per pipeline start) or "triggered" (a clip per
+                 detection burst or armed period, with preroll_s / postroll_s around it; the pre-roll is
+                 kept in memory, at most preroll_max_mb; clip_queue_max_mb bounds the frames waiting for
+                 the disk, beyond which frames are dropped)
+    width/height: camera resolution, before the 90 degree rotation
+    hfov_deg:    field of view along the camera width, used to convert pixels to degrees
+    loss_timeout_s: time without detections before the tracker starts reacquiring the target
+    display:     whether this unit drives the HDMI output (at most one unit)
+    """
+    name: str
+    camera: str = "/dev/video0"
+    gimbal_port: str = "/dev/ttyTHS1"
+    ipc_port: int = 5000
+    preview_port: int = 5001
+    preview_transport: str = "shm"
+    h264_preview: bool = False
+    h264_port: int = 5100
+    h264_bitrate_kbps: int = 500
+    h264_keyframe_interval: int = 30
+    h264_encoder: str = "auto"
+    recording_mode: str = "continuous"
+    preroll_s: float = 5.0
+    postroll_s: float = 5.0
+    preroll_max_mb: int = 128
+    clip_queue_max_mb: int = 128
+    width: int = 1920
+    height: int = 1080
+    hfov_deg: float = 60.0
+    loss_timeout_s: float = 0.3
+    display: bool = False
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @staticmethod
+    def from_dict(d: dict) -> "UnitConfig":
+        known = {f.name for f in fields(UnitConfig)}
+        unknown = set(d) - known
+        if unknown:
+            raise ValueError(f"Unknown unit config keys: {sorted(unknown)}")
+        return UnitConfig(**d)
+
+DEFAULT_UNITS = [UnitConfig(name="main", display=True)]
+
+def load_units(path: str = UNITS_CONFIG_PATH) -> list[UnitConfig]:
+    """
+    Load the unit list from a JSON file of the form
+        [{"name": "main", "camera": "/dev/video0", "gimbal_port": "/dev/ttyTHS1", ...}, ...]
+    Falls back to a single unit matching the original hardware setup if the file doesn't exist.
+    """
+    if not os.path.isfile(path):
+        logger.info("No unit config at %s, using the default single unit", path)
+        return list(DEFAULT_UNITS)
+
+    with open(path) as f:
+        units = [UnitConfig.from_dict(d) for d in json.load(f)]
+
+    validate_units(units)
+    return units
+
+def validate_units(units: list[UnitConfig]):
+    if not units:
+        raise ValueError("At least one unit must be configured")
+
+    names = [u.name for u in units]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate unit names: {names}")
+
+    ports = [p for u in units for p in (u.ipc_port, u.preview_port)]
+    ports += [u.h264_port for u in units if u.h264_preview]
+    if len(set(ports)) != len(ports):
+        raise ValueError(f"Duplicate ports in unit config: {ports}")
+
+    for u in units:
+        if u.preview_transport not in ("shm", "tcp"):
+            raise ValueError(f"Unknown preview transport for unit {u.name}: {u.preview_transport}")
+        if u.h264_encoder not in ("auto", "hw", "sw"):
+            raise ValueError(f"Unknown H.264 encoder for unit {u.name}: {u.h264_encoder}")
+        if u.recording_mode not in ("continuous", "triggered"):
+            raise ValueError(f"Unknown recording mode for unit {u.name}: {u.recording_mode}")
+        if u.preroll_s < 0 or u.postroll_s < 0 or u.preroll_max_mb <= 0 or u.clip_queue_max_mb <= 0:
+            raise ValueError(f"Invalid pre/post-roll settings for unit {u.name}")
+        if u.h264_bitrate_kbps <= 0 or u.h264_keyframe_interval <= 0:
+            raise ValueError(f"Invalid H.264 preview settings for unit {u.name}")
+
+    if sum(1 for u in units if u.display) > 1:
+        raise ValueError("At most one unit can drive the display")
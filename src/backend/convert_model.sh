@@ -3,6 +3,8 @@ set -e
 
 # Resolve the directory this script lives in
 SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+# must match the number of units in units.json, all cameras are batched into one inference call
+BATCH_SIZE="${BATCH_SIZE:-1}"
 
 cd ~/ultralytics
 
@@ -10,9 +12,9 @@ python3 export_yolo11.py \
     -w "${SCRIPT_DIR}/models/model.pt" \
     -s 540 960 \
     --simplify \
-    --batch 1
+    --batch "${BATCH_SIZE}"
 
-rm -f "${SCRIPT_DIR}/cv_process/model_b1_gpu0_fp16.engine"
+rm -f "${SCRIPT_DIR}"/cv_process/model_b*_gpu0_fp16.engine
 
 echo "Created ${SCRIPT_DIR}/models/model.pt.onnx"
-echo "Next run of deepstream will create the TensorRT engine file at ${SCRIPT_DIR}/models/model_b1_gpu0_fp16.engine"
\ No newline at end of file
+echo "Next run of deepstream will create the TensorRT engine file at ${SCRIPT_DIR}/cv_process/model_b${BATCH_SIZE}_gpu0_fp16.engine"
\ No newline at end of file
@@ -1,27 +1,38 @@
 import threading
 
 from cv_process import ipc
-from cv_process.ipc import create_rocam_ipc_server, BoundingBox
+from cv_process.ipc import create_rocam_ipc_server, ARMED, BoundingBox
+from config import UnitConfig
 from utils import *
 import subprocess
 import os
 import atexit
 import signal
 import sys
+import json
 
 sys.modules["ipc"] = ipc
 logger = logging.getLogger(__name__)
 
 
 class CVPipeline:
-    def __init__(self, detection_callback):
+    """
+    Runs the cv process, which captures from every unit's camera and batches
+    all frames into a single inference call.
+
+    Each unit has its own IPC channel; detections received on a channel are
+    passed to detection_callback(unit_name, bbox).
+    """
+
+    def __init__(self, units: list[UnitConfig], detection_callback):
+        self._units = units
         self._detection_callback = detection_callback
-        self._ipc_server = create_rocam_ipc_server()
+        # the cv process starts and stops triggered recordings on arm/disarm
+        self._armed = False
+        self._send_lock = threading.Lock()
+        self._ipc_servers = {u.name: create_rocam_ipc_server(u.ipc_port) for u in units}
 
-        self._p = subprocess.Popen(
-            ["python3", os.path.join(os.path.dirname(__file__), "cv_process", "main.py")],
-            cwd=os.path.join(os.path.dirname(__file__), "cv_process"),
-        )
+        self._p = self._start_process()
 
         cleanup = lambda: self._p.kill()
         def cleanup_signals(signum, frame):
@@ -33,36 +44,65 @@ class CVPipeline:
         signal.signal(signal.SIGTERM, cleanup_signals)
 
         logger.info("Waiting for CV process to start.....")
-        self._conn = self._ipc_server.accept()
+        self._conns = {name: server.accept() for name, server in self._ipc_servers.items()}
+        for name in self._conns:
+            self._send_armed(name)
+
+        for unit in units:
+            threading.Thread(target=self._recv_loop, args=(unit.name,), name=f"ipc-recv-{unit.name}", daemon=True).start()
+        threading.Thread(target=self._restart_process_loop, name="cv-restart", daemon=True).start()
 
-        threading.Thread(target=self._recv_loop, daemon=True).start()
-        threading.Thread(target=self._restart_process_loop, daemon=True).start()
+        logger.info("CV process initialized with %d unit(s)", len(units))
 
-        logger.info("CV process initialized")
+    def _send_armed(self, unit_name: str):
+        try:
+            with self._send_lock:
+                self._conns[unit_name].send((ARMED, self._armed))
+        except OSError as e:
+            # the recv loop reconnects and sends it again
+            logger.warning("Failed to send the armed state to the cv process: %s", e)
+
+    def set_armed(self, armed: bool):
+        self._armed = armed
+        for name in self._conns:
+            self._send_armed(name)
+
+    @property
+    def pid(self) -> int:
+        return self._p.pid
+
+    def _start_process(self):
+        return subprocess.Popen(
+            [
+                "python3",
+                os.path.join(os.path.dirname(__file__), "cv_process", "main.py"),
+                json.dumps([u.to_dict() for u in self._units]),
+            ],
+            cwd=os.path.join(os.path.dirname(__file__), "cv_process"),
+        )
 
     def _restart_process_loop(self):
         while True:
             self._p.wait()
-            self._p = subprocess.Popen(
-                ["python3", os.path.join(os.path.dirname(__file__), "cv_process", "main.py")],
-                cwd=os.path.join(os.path.dirname(__file__), "cv_process"),
-            )
+            self._p = self._start_process()
 
-    def _recv_loop(self):
+    def _recv_loop(self, unit_name: str):
         while True:
             try:
-                data = self._conn.recv()
+                data = self._conns[unit_name].recv()
                 if isinstance(data, BoundingBox):
                     # rotate 90 degrees
-                    self._detection_callback(BoundingBox(
+                    self._detection_callback(unit_name, BoundingBox(
                         pts_s=data.pts_s,
                         conf=data.conf,
                         left=1-(data.top + data.height),
                         top=data.left,
                         width=data.height,
                         height=data.width,
+                        capture_time_s=data.capture_time_s,
                     ))
             except EOFError:
                 # client disconnected
-                self._conn = self._ipc_server.accept()
-                logger.info("CV process reconnected")
+                self._conns[unit_name] = self._ipc_servers[unit_name].accept()
+                logger.info("CV process reconnected on unit %s", unit_name)
+                self._send_armed(unit_name)
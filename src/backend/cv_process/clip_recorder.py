@@ -0,0 +1,256 @@
+import os
+import queue
+import struct
+import threading
+import time
+import logging
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger("cv_process.clip_recorder")
+
+# AVI 1.0 sizes are 32 bit; start a new clip well before that
+MAX_CLIP_BYTES = 2 ** 31 - 2 ** 26
+
+_AVIF_HASINDEX = 0x10
+_AVIIF_KEYFRAME = 0x10
+
+class AviMjpegWriter:
+    """
+    Writes JPEG frames to an MJPEG AVI with an idx1 index, readable by anything that plays the
+    avimux recordings (and by avi.AviMjpegReader). The header sizes and frame counts are filled
+    in by close(); a file that is never closed is still readable by walking its chunks.
+    """
+
+    def __init__(self, path: str, width: int, height: int, fps: float):
+        self.path = path
+        self.bytes_written = 0
+        self._fps = fps
+        self._f = open(path, "wb")
+        self._index: list[tuple[int, int]] = []
+
+        strf = struct.pack("<IiiHH4sIiiII", 40, width, height, 1, 24, b"MJPG", width * height * 3, 0, 0, 0, 0)
+        # rate / scale = fps, with enough precision for e.g. 59.94
+        strh = struct.pack("<4s4sIHHIIIIIIiI4h", b"vids", b"MJPG", 0, 0, 0, 0, 1000, round(fps * 1000), 0,
+                           0, 0, -1, 0, 0, 0, width, height)
+        strl = self._list(b"strl", self._chunk(b"strh", strh) + self._chunk(b"strf", strf))
+        avih = struct.pack("<IIIIIIIIII4I", round(1e6 / fps), 0, 0, _AVIF_HASINDEX, 0, 0, 1, 0, width, height,
+                           0, 0, 0, 0)
+        hdrl = self._list(b"hdrl", self._chunk(b"avih", avih) + strl)
+
+        self._f.write(b"RIFF" + struct.pack("<I", 0) + b"AVI " + hdrl)
+        # offsets patched by close()
+        self._avih_frames_offset = 12 + 12 + 8 + 16
+        self._strh_length_offset = 12 + len(hdrl) - len(strl) + 12 + 8 + 32
+        self._movi_offset = self._f.tell()
+        self._f.write(b"LIST" + struct.pack("<I", 0) + b"movi")
+        self.bytes_written = self._f.tell()
+
+    @staticmethod
+    def _chunk(fourcc: bytes, data: bytes) -> bytes:
+        return fourcc + struct.pack("<I", len(data)) + data + (b"\0" if len(data) & 1 else b"")
+
+    @classmethod
+    def _list(cls, list_type: bytes, data: bytes) -> bytes:
+        return b"LIST" + struct.pack("<I", len(data) + 4) + list_type + data
+
+    def write(self, jpeg: bytes):
+        # idx1 offsets are relative to the "movi" fourcc
+        self._index.append((self._f.tell() - (self._movi_offset + 8), len(jpeg)))
+        chunk = self._chunk(b"00dc", jpeg)
+        self._f.write(chunk)
+        self.bytes_written += len(chunk)
+
+    @property
+    def frame_count(self) -> int:
+        return len(self._index)
+
+    def close(self):
+        """Write the index and the sizes. The file is closed even if that fails (e.g. disk full)."""
+        f = self._f
+        if f.closed:
+            return
+        try:
+            movi_end = f.tell()
+            f.write(b"idx1" + struct.pack("<I", 16 * len(self._index)))
+            f.write(b"".join(struct.pack("<4sIII", b"00dc", _AVIIF_KEYFRAME, offset, size)
+                             for offset, size in self._index))
+            end = f.tell()
+
+            f.seek(4)
+            f.write(struct.pack("<I", end - 8))
+            f.seek(self._movi_offset + 4)
+            f.write(struct.pack("<I", movi_end - self._movi_offset - 8))
+            f.seek(self._avih_frames_offset)
+            f.write(struct.pack("<I", len(self._index)))
+            f.seek(self._strh_length_offset)
+            f.write(struct.pack("<I", len(self._index)))
+        finally:
+            f.close()
+
+class ClipRecorder:
+    """
+    Detection-triggered recording of one unit.
+
+    The encoded frames are kept in an in-memory pre-roll ring, bounded by preroll_s and
+    preroll_max_bytes. A trigger (a detection, or the system being armed) starts a clip with the
+    pre-roll, then every frame is written until postroll_s after the last trigger (or disarm).
+    Every clip is a separate, indexed AVI named <unit>_<start time>.avi in directory, with the
+    detection events of the clip next to it, like the continuous recordings.
+
+    on_frame(), trigger() and set_armed() are called from the pipeline threads; the files are
+    written by a writer thread, behind a queue bounded by max_queued_bytes so a slow disk drops
+    frames rather than growing memory without bound.
+    """
+
+    def __init__(self, unit: str, directory: str, width: int, height: int, fps: float = 60.0,
+                 preroll_s: float = 5.0, postroll_s: float = 5.0, preroll_max_bytes: int = 128 * 1024 * 1024,
+                 max_queued_bytes: int = 128 * 1024 * 1024, event_gap_s: float = 1.0):
+        self._unit = unit
+        self._directory = directory
+        self._width = width
+        self._height = height
+        self._fps = fps
+        self._preroll_s = preroll_s
+        self._postroll_s = postroll_s
+        self._preroll_max_bytes = preroll_max_bytes
+        self._max_queued_bytes = max_queued_bytes
+        self._event_gap_s = event_gap_s
+
+        self._lock = threading.Lock()
+        # (arrival time, jpeg) of the pre-roll
+        self._ring: deque[tuple[float, bytes]] = deque()
+        self._ring_bytes = 0
+        self._armed = False
+        self._last_trigger: Optional[float] = None
+        self._last_detection: Optional[float] = None
+        # arrival time of the first frame of the current clip, None while not recording
+        self._clip_start: Optional[float] = None
+        self._dropped = 0
+
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._queued_bytes = 0
+        self._thread = threading.Thread(target=self._writer, name=f"clip-writer-{unit}", daemon=True)
+        self._thread.start()
+
+    # ── Pipeline side ──────────────────────────────────────────────────────────
+    def trigger(self, now: Optional[float] = None, detection: bool = True):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._last_trigger = now
+            if detection:
+                last, self._last_detection = self._last_detection, now
+                if self._clip_start is not None and (last is None or now - last > self._event_gap_s):
+                    self._enqueue(("event", now), 0)
+
+    def set_armed(self, armed: bool):
+        with self._lock:
+            was_armed, self._armed = self._armed, armed
+        if was_armed and not armed:
+            # the post-roll starts at the disarm
+            self.trigger(detection=False)
+
+    def on_frame(self, jpeg: bytes, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            recording = self._clip_start is not None
+            triggered = self._armed or (self._last_trigger is not None and now - self._last_trigger <= self._postroll_s)
+
+            if triggered and not recording:
+                self._start_clip(now)
+            elif recording and not triggered:
+                self._clip_start = None
+                self._enqueue(("close",), 0)
+
+            if self._clip_start is not None:
+                self._enqueue(("frame", jpeg, now), len(jpeg))
+            else:
+                self._ring.append((now, jpeg))
+                self._ring_bytes += len(jpeg)
+                while self._ring and (self._ring_bytes > self._preroll_max_bytes
+                                      or now - self._ring[0][0] > self._preroll_s):
+                    self._ring_bytes -= len(self._ring.popleft()[1])
+
+    def _start_clip(self, now: float):
+        self._clip_start = self._ring[0][0] if self._ring else now
+        self._enqueue(("open", self._clip_start), 0)
+        if self._last_detection is not None and self._last_detection >= self._clip_start:
+            self._enqueue(("event", self._last_detection), 0)
+        # the pre-roll is already in memory, it is handed over to the writer regardless of the queue limit
+        for t, frame in self._ring:
+            self._queue.put(("frame", frame, t))
+            self._queued_bytes += len(frame)
+        self._ring.clear()
+        self._ring_bytes = 0
+
+    def _enqueue(self, item: tuple, size: int):
+        if size and self._queued_bytes + size > self._max_queued_bytes:
+            self._dropped += 1
+            if self._dropped % 60 == 1:
+                logger.warning(f"Clip writer of {self._unit} is behind, {self._dropped} frames dropped")
+            return
+        self._queued_bytes += size
+        self._queue.put(item)
+
+    def close(self, timeout: Optional[float] = 10.0):
+        """Finish the current clip, if any, and stop the writer."""
+        with self._lock:
+            self._clip_start = None
+            self._queue.put(("close",))
+            self._queue.put(None)
+        self._thread.join(timeout)
+
+    # ── Writer thread ──────────────────────────────────────────────────────────
+    def _clip_path(self, start: float) -> str:
+        wall_time = time.time() - (time.monotonic() - start)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(wall_time))
+        path = os.path.join(self._directory, f"{self._unit}_{stamp}.avi")
+        n = 1
+        while os.path.exists(path):
+            n += 1
+            path = os.path.join(self._directory, f"{self._unit}_{stamp}-{n}.avi")
+        return path
+
+    def _writer(self):
+        writer: Optional[AviMjpegWriter] = None
+        # arrival time of the first frame of the current file, event times are relative to it
+        file_start = 0.0
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                if item[0] == "open":
+                    file_start = item[1]
+                    writer = AviMjpegWriter(self._clip_path(file_start), self._width, self._height, self._fps)
+                    logger.info(f"Started clip {writer.path}")
+                elif item[0] == "frame":
+                    _, jpeg, t = item
+                    with self._lock:
+                        self._queued_bytes -= len(jpeg)
+                    if writer is None:
+                        continue
+                    if writer.bytes_written + len(jpeg) > MAX_CLIP_BYTES:
+                        # continue in a new file, which starts with this frame
+                        writer.close()
+                        file_start = t
+                        writer = AviMjpegWriter(self._clip_path(file_start), self._width, self._height, self._fps)
+                        logger.info(f"Continuing clip in {writer.path}")
+                    writer.write(jpeg)
+                elif item[0] == "event" and writer is not None:
+                    # same format as the backend's DetectionEventLog
+                    with open(writer.path + ".events", "a") as f:
+                        f.write(f"{max(0.0, item[1] - file_start):.3f}\n")
+                elif item[0] == "close" and writer is not None:
+                    writer.close()
+                    logger.info(f"Finished clip {writer.path} ({writer.frame_count} frames)")
+                    writer = None
+            except OSError as e:
+                logger.error(f"Clip writer error: {e}")
+                if writer is not None:
+                    try:
+                        # keep what was written readable, and don't leak the file handle
+                        writer.close()
+                    except OSError:
+                        pass
+                writer = None
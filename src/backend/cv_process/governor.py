@@ -0,0 +1,158 @@
+import glob
+import os
+import time
+import logging
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+logger = logging.getLogger("cv_process.governor")
+
+@dataclass(frozen=True)
+class Level:
+    """Pipeline settings of one governor step. Level 0 is full quality."""
+    # nvinfer interval: number of frames skipped between inferences
+    infer_interval: int
+    preview_fps: int
+    preview_quality: int
+    recording_quality: int
+
+LEVELS = (
+    Level(infer_interval=0, preview_fps=30, preview_quality=70, recording_quality=70),
+    Level(infer_interval=0, preview_fps=15, preview_quality=60, recording_quality=70),
+    Level(infer_interval=1, preview_fps=15, preview_quality=50, recording_quality=60),
+    Level(infer_interval=2, preview_fps=10, preview_quality=40, recording_quality=50),
+    Level(infer_interval=4, preview_fps=5, preview_quality=30, recording_quality=40),
+)
+
+@dataclass
+class Readings:
+    max_temp_c: Optional[float]
+    hottest_zone: Optional[str]
+    cpu_load: Optional[float]
+    fps: Optional[float]
+
+class Governor:
+    """
+    Steps the pipeline down through LEVELS when the board gets too hot, the CPUs are saturated or
+    the pipeline falls behind the camera frame rate, and back up once there is headroom again.
+
+    Sensors are read below root (thermal zones from sys/class/thermal, CPU load from proc/stat),
+    so a fake tree can stand in for the real one. update() is called periodically with the
+    measured pipeline fps and calls apply(level) on every change.
+
+    Stepping down needs the pressure to last for down_after_s, stepping up needs all readings
+    below the (lower) recovery thresholds for up_after_s, and nothing changes within hold_s of the
+    previous change, so the effect of a step is seen before the next one.
+    """
+
+    def __init__(self, apply: Callable[[Level], None], root: str = "/", target_fps: float = 60.0,
+                 hot_c: float = 80.0, cool_c: float = 72.0, busy_load: float = 0.9, idle_load: float = 0.7,
+                 min_fps_ratio: float = 0.85, recover_fps_ratio: float = 0.95,
+                 down_after_s: float = 3.0, up_after_s: float = 30.0, hold_s: float = 10.0):
+        self._apply = apply
+        self._root = root
+        self._target_fps = target_fps
+        self._hot_c = hot_c
+        self._cool_c = cool_c
+        self._busy_load = busy_load
+        self._idle_load = idle_load
+        self._min_fps_ratio = min_fps_ratio
+        self._recover_fps_ratio = recover_fps_ratio
+        self._down_after_s = down_after_s
+        self._up_after_s = up_after_s
+        self._hold_s = hold_s
+
+        self.level = 0
+        self._changed_at = float("-inf")
+        self._pressure_since: Optional[float] = None
+        self._headroom_since: Optional[float] = None
+        self._last_cpu: Optional[tuple[int, int]] = None
+
+    def _path(self, *parts: str) -> str:
+        return os.path.join(self._root, *parts)
+
+    def _read_temps(self) -> dict[str, float]:
+        temps = {}
+        for zone in sorted(glob.glob(self._path("sys", "class", "thermal", "thermal_zone*"))):
+            try:
+                with open(os.path.join(zone, "temp")) as f:
+                    millideg = int(f.read().strip())
+                name = os.path.basename(zone)
+                if os.path.isfile(os.path.join(zone, "type")):
+                    with open(os.path.join(zone, "type")) as f:
+                        name = f.read().strip()
+            except (OSError, ValueError):
+                # some zones (e.g. of powered down devices) can't be read
+                continue
+            temps[name] = millideg / 1000.0
+        return temps
+
+    def _read_cpu_load(self) -> Optional[float]:
+        """Fraction of CPU time not idle since the previous call, over all cores."""
+        try:
+            with open(self._path("proc", "stat")) as f:
+                fields = [int(v) for v in f.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        # user nice system idle iowait irq softirq steal ...
+        idle, total = fields[3] + fields[4], sum(fields[:8])
+        last, self._last_cpu = self._last_cpu, (idle, total)
+        if last is None or total <= last[1]:
+            return None
+        return 1.0 - (idle - last[0]) / (total - last[1])
+
+    def read(self, fps: Optional[float]) -> Readings:
+        temps = self._read_temps()
+        hottest = max(temps, key=temps.get) if temps else None
+        return Readings(max_temp_c=temps[hottest] if hottest else None, hottest_zone=hottest,
+                        cpu_load=self._read_cpu_load(), fps=fps)
+
+    def _pressure(self, r: Readings) -> Optional[str]:
+        if r.max_temp_c is not None and r.max_temp_c >= self._hot_c:
+            return f"{r.hottest_zone} at {r.max_temp_c:.1f}C"
+        if r.cpu_load is not None and r.cpu_load >= self._busy_load:
+            return f"CPU load {r.cpu_load:.0%}"
+        if r.fps is not None and r.fps < self._min_fps_ratio * self._target_fps:
+            return f"pipeline at {r.fps:.1f} fps"
+        return None
+
+    def _headroom(self, r: Readings) -> bool:
+        return ((r.max_temp_c is None or r.max_temp_c < self._cool_c)
+                and (r.cpu_load is None or r.cpu_load < self._idle_load)
+                and (r.fps is None or r.fps >= self._recover_fps_ratio * self._target_fps))
+
+    def update(self, fps: Optional[float], now: Optional[float] = None) -> Readings:
+        now = time.monotonic() if now is None else now
+        r = self.read(fps)
+
+        pressure = self._pressure(r)
+        if pressure:
+            self._headroom_since = None
+            if self._pressure_since is None:
+                self._pressure_since = now
+        else:
+            self._pressure_since = None
+            if self._headroom(r):
+                if self._headroom_since is None:
+                    self._headroom_since = now
+            else:
+                self._headroom_since = None
+
+        if now - self._changed_at < self._hold_s:
+            return r
+
+        if pressure and now - self._pressure_since >= self._down_after_s and self.level < len(LEVELS) - 1:
+            self._set_level(self.level + 1, f"stepping down: {pressure}", now)
+        elif (self._headroom_since is not None and now - self._headroom_since >= self._up_after_s
+              and self.level > 0):
+            self._set_level(self.level - 1, f"stepping up: headroom for {now - self._headroom_since:.0f}s", now)
+        return r
+
+    def _set_level(self, level: int, reason: str, now: float):
+        log = logger.warning if level > self.level else logger.info
+        log(f"Governor {reason}, level {self.level} -> {level}: {LEVELS[level]}")
+        self.level = level
+        self._changed_at = now
+        self._pressure_since = None
+        self._headroom_since = None
+        self._apply(LEVELS[level])
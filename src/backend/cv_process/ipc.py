@@ -2,6 +2,7 @@ from multiprocessing.connection import Client, Listener
 from dataclasses import dataclass
 
 # coordinates are normalized (0.0 to 1.0)
+# capture_time_s is the time the frame was captured, on the time.monotonic() clock
 @dataclass
 class BoundingBox:
     pts_s: float
@@ -10,14 +11,20 @@ class BoundingBox:
     top: float
     width: float
     height: float
+    capture_time_s: float = 0.0
 
     def center(self) -> tuple[float, float]:
         cx = self.left + self.width / 2.0
         cy = self.top + self.height / 2.0
         return (cx, cy)
 
-def create_rocam_ipc_server():
-    return Listener(('localhost', 5000))
+# backend -> cv process, sent on connect and on every arm/disarm: ("armed", bool)
+# plain tuples, so they unpickle in the cv process, which imports this module as "ipc" rather than
+# "cv_process.ipc"
+ARMED = "armed"
 
-def create_rocam_ipc_client():
-    return Client(('localhost', 5000))
\ No newline at end of file
+def create_rocam_ipc_server(port: int = 5000):
+    return Listener(('localhost', port))
+
+def create_rocam_ipc_client(port: int = 5000):
+    return Client(('localhost', port))
\ No newline at end of file
@@ -1,6 +1,9 @@
 import gi
 
-from ipc import create_rocam_ipc_client, BoundingBox
+from ipc import create_rocam_ipc_client, ARMED, BoundingBox
+from preview_ring import PreviewRing, ring_path
+from governor import Governor, Level
+from clip_recorder import ClipRecorder
 
 gi.require_version('Gst', '1.0')
 from gi.repository import GLib, Gst
@@ -8,15 +11,39 @@ import time
 import pyds
 import sys
 import os
+import json
 import logging
+import threading
 
 logger = logging.getLogger("cv_process")
 
+# used when the backend doesn't pass a unit list (e.g. running this script by hand)
+DEFAULT_UNITS = [{
+    "name": "main",
+    "camera": "/dev/video0",
+    "ipc_port": 5000,
+    "preview_port": 5001,
+    "preview_transport": "shm",
+    "width": 1920,
+    "height": 1080,
+    "display": True,
+}]
+
+units = DEFAULT_UNITS
+# shared with the backend (recordings.py), every start of the pipeline creates a new recording per unit
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "recordings")
+session = time.strftime("%Y%m%d-%H%M%S")
+# frames from all units are scaled to the resolution of the first unit by nvstreammux
 WIDTH = 1920
 HEIGHT = 1080
-CAMERA = "/dev/video0"
-ipc_client = None
+ipc_clients = []
+# shared memory preview rings by unit index, units without one stream the preview over TCP
+preview_rings = {}
+# detection-triggered recorders by unit index, for units with "recording_mode": "triggered"
+recorders = {}
+pipeline = None
 osd = None
+glshader = None
 
 def bus_call(bus, message, loop):
     t = message.type
@@ -35,36 +62,42 @@ def bus_call(bus, message, loop):
 
 _fps_last_time = time.perf_counter()
 _fps_time_list = [0.0]
+# measured at the inference output, read by the governor
+pipeline_fps = None
 
 def inference_stop_probe(pad, info, u_data):
     global _fps_last_time
     global _fps_time_list
-    global osd
-    global ipc_client
-    global glshader
+    global pipeline_fps
 
     gst_buffer = info.get_buffer()
     if not gst_buffer:
         print("Unable to get GstBuffer ")
         return
 
-    pts_s = gst_buffer.pts  / 1e9  # presentation timestamp in seconds
-
     now = time.perf_counter()
     avg_fps = len(_fps_time_list) / (now - _fps_time_list[0])
     _fps_last_time = now
     _fps_time_list.append(now)
     if len(_fps_time_list) > 60:
         _fps_time_list.pop(0)
+        pipeline_fps = avg_fps
+
+    if osd:
+        osd.set_property("text", f"FPS: {avg_fps:.1f}")
 
-    osd.set_property("text", f"FPS: {avg_fps:.1f}")
+    # pts are in pipeline running time, convert them to the time.monotonic() clock so the backend
+    # can match detections to the gimbal angle at capture time
+    running_time_s = (pipeline.get_clock().get_time() - pipeline.get_base_time()) / 1e9
+    pts_to_monotonic = time.monotonic() - running_time_s
 
     # Retrieve batch metadata from the gst_buffer
     # Note that pyds.gst_buffer_get_nvds_batch_meta() expects the
     # C address of gst_buffer as input, which is obtained with hash(gst_buffer)
     batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
     l_frame = batch_meta.frame_meta_list
-    bounding_box = None
+    # best bounding box of each unit in this batch, indexed by mux pad
+    bounding_boxes = [None] * len(units)
     while l_frame is not None:
         try:
             # Note that l_frame.data needs a cast to pyds.NvDsFrameMeta
@@ -76,6 +109,9 @@ def inference_stop_probe(pad, info, u_data):
         except StopIteration:
             break
 
+        unit_index = frame_meta.pad_index
+        pts_s = frame_meta.buf_pts / 1e9  # presentation timestamp in seconds
+
         l_obj = frame_meta.obj_meta_list
         while l_obj is not None:
             try:
@@ -85,14 +121,16 @@ def inference_stop_probe(pad, info, u_data):
                 break
 
             bbox = obj_meta.detector_bbox_info.org_bbox_coords
-            if not bounding_box or obj_meta.confidence > bounding_box.conf:
-                bounding_box = BoundingBox(
+            best = bounding_boxes[unit_index]
+            if not best or obj_meta.confidence > best.conf:
+                bounding_boxes[unit_index] = BoundingBox(
                     pts_s=pts_s,
                     conf=obj_meta.confidence,
                     left=bbox.left / WIDTH,
                     top=bbox.top / HEIGHT,
                     width=bbox.width / WIDTH,
-                    height=bbox.height / HEIGHT
+                    height=bbox.height / HEIGHT,
+                    capture_time_s=pts_s + pts_to_monotonic,
                 )
             try:
                 l_obj = l_obj.next
@@ -104,38 +142,178 @@ def inference_stop_probe(pad, info, u_data):
         except StopIteration:
             break
 
-    if bounding_box and bounding_box.conf > 0.4:
-        ipc_client.send(bounding_box)
-        cx = bounding_box.left + bounding_box.width / 2.0
-        cy = bounding_box.top + bounding_box.height / 2.0
+    for i, (unit, ipc_client, bounding_box) in enumerate(zip(units, ipc_clients, bounding_boxes)):
+        if bounding_box and bounding_box.conf > 0.4:
+            ipc_client.send(bounding_box)
+            if i in recorders:
+                recorders[i].trigger()
+
+            if unit.get("display") and glshader:
+                cx = bounding_box.left + bounding_box.width / 2.0
+                cy = bounding_box.top + bounding_box.height / 2.0
 
-        tx = 0.5 - cx
-        ty = 0.5 - cy
-        glshader.set_property('uniforms',
-                              Gst.Structure.new_from_string(f"uniforms, tx=(float){tx}, ty=(float){ty}, scale=(float)1.0"))
+                tx = 0.5 - cx
+                ty = 0.5 - cy
+                glshader.set_property('uniforms',
+                                      Gst.Structure.new_from_string(f"uniforms, tx=(float){tx}, ty=(float){ty}, scale=(float)1.0"))
 
     return Gst.PadProbeReturn.OK
 
 
-def main():
-    global pipeline, osd, glshader
-    global ipc_client
+def on_preview_sample(sink, ring):
+    sample = sink.emit("pull-sample")
+    buffer = sample.get_buffer()
+    ok, info = buffer.map(Gst.MapFlags.READ)
+    if not ok:
+        return Gst.FlowReturn.OK
+    try:
+        if not ring.write(info.data, time.time()):
+            logger.warning(f"Preview frame of {info.size} bytes doesn't fit in the ring, dropped")
+    finally:
+        buffer.unmap(info)
+    return Gst.FlowReturn.OK
+
+
+def on_recording_sample(sink, recorder):
+    sample = sink.emit("pull-sample")
+    buffer = sample.get_buffer()
+    ok, info = buffer.map(Gst.MapFlags.READ)
+    if ok:
+        try:
+            recorder.on_frame(info.data)
+        finally:
+            buffer.unmap(info)
+    return Gst.FlowReturn.OK
 
-    logger.info("Trying to connect to IPC server...")
-    ipc_client = create_rocam_ipc_client()
-    logger.info("Connected to IPC server.")
 
-    Gst.init(None)
+def create_recorders():
+    for i, unit in enumerate(units):
+        if unit.get("recording_mode", "continuous") == "triggered":
+            recorders[i] = ClipRecorder(unit["name"], RECORDINGS_DIR, unit["width"], unit["height"],
+                                        preroll_s=unit.get("preroll_s", 5.0), postroll_s=unit.get("postroll_s", 5.0),
+                                        preroll_max_bytes=unit.get("preroll_max_mb", 128) * 1024 * 1024,
+                                        max_queued_bytes=unit.get("clip_queue_max_mb", 128) * 1024 * 1024)
+
+
+def ipc_recv_loop(i: int, ipc_client):
+    # messages from the backend
+    while True:
+        try:
+            message = ipc_client.recv()
+        except (EOFError, OSError):
+            return
+        except Exception as e:
+            # e.g. a message that doesn't unpickle here: skip it rather than stop listening
+            logger.error(f"Invalid message from the backend on unit {i}: {e!r}")
+            continue
+        try:
+            if isinstance(message, tuple) and message[:1] == (ARMED,) and i in recorders:
+                recorders[i].set_armed(bool(message[1]))
+        except Exception:
+            logger.exception(f"Failed to handle {message!r} from the backend on unit {i}")
 
-    pipeline_desc = f"""
-        nvv4l2camerasrc device={CAMERA} cap-buffers=2 !
-        video/x-raw(memory:NVMM),framerate=60/1,width={WIDTH},height={HEIGHT} !
-        tee name=t
 
-        t. !
+def open_preview_rings():
+    for i, unit in enumerate(units):
+        if unit.get("preview_transport", "shm") != "shm":
+            continue
+        try:
+            preview_rings[i] = PreviewRing(ring_path(unit["name"]), writer=True)
+        except OSError as e:
+            logger.warning(f"Can't open the preview ring of {unit['name']}, falling back to TCP: {e}")
+
+
+def apply_governor_level(level: Level):
+    pipeline.get_by_name("infer").set_property("interval", level.infer_interval)
+    for i in range(len(units)):
+        pipeline.get_by_name(f"previewrate{i}").set_property("max-rate", level.preview_fps)
+        pipeline.get_by_name(f"previewenc{i}").set_property("quality", level.preview_quality)
+        pipeline.get_by_name(f"recenc{i}").set_property("quality", level.recording_quality)
+
+
+def governor_tick(governor):
+    try:
+        governor.update(pipeline_fps)
+    except Exception as e:
+        logger.error(f"Governor error: {e}")
+    return True
+
+
+def source_desc(unit) -> str:
+    width, height = unit["width"], unit["height"]
+    if unit["camera"] == "synthetic":
+        return f"""
+        videotestsrc is-live=1 pattern=ball !
+        video/x-raw,framerate=60/1,width={width},height={height} !
         nvvideoconvert !
-        mux.sink_0 nvstreammux name=mux width={WIDTH} height={HEIGHT} live-source=1 batch-size=1 !
-        nvinfer name=infer config-file-path=pgie_config.txt !
+        video/x-raw(memory:NVMM),framerate=60/1,width={width},height={height}
+        """
+    return f"""
+        nvv4l2camerasrc device={unit["camera"]} cap-buffers=2 !
+        video/x-raw(memory:NVMM),framerate=60/1,width={width},height={height}
+        """
+
+
+def h264_encoder_desc(unit) -> str:
+    bitrate_kbps = unit.get("h264_bitrate_kbps", 500)
+    keyframe_interval = unit.get("h264_keyframe_interval", 30)
+    encoder = unit.get("h264_encoder", "auto")
+    if encoder == "auto":
+        encoder = "hw" if Gst.ElementFactory.find("nvv4l2h264enc") else "sw"
+
+    if encoder == "hw":
+        return f"""
+        nvv4l2h264enc bitrate={bitrate_kbps * 1000} control-rate=1 iframeinterval={keyframe_interval}
+            idrinterval={keyframe_interval} insert-sps-pps=1 maxperf-enable=1 !
+        """
+    return f"""
+        nvvideoconvert !
+        video/x-raw,format=I420 !
+        x264enc bitrate={bitrate_kbps} key-int-max={keyframe_interval} tune=zerolatency speed-preset=ultrafast threads=2 !
+        """
+
+
+def h264_preview_desc(i: int, unit) -> str:
+    width, height = unit["width"], unit["height"]
+    # fragments of one frame each: the relay starts viewers at a keyframe fragment, and one frame
+    # of muxing latency is all the preview gets
+    return f"""
+        t{i}. !
+        queue leaky=2 max-size-buffers=2 !
+        nvvideoconvert !
+        video/x-raw(memory:NVMM),width={int(width/4)},height={int(height/4)} !
+        videorate !
+        video/x-raw(memory:NVMM),framerate=30/1 !
+        {h264_encoder_desc(unit)}
+        h264parse !
+        mp4mux streamable=true fragment-duration=33 !
+        tcpclientsink port={unit.get("h264_port", 5100)}
+    """
+
+
+def unit_pipeline_desc(i: int, unit) -> str:
+    name, width, height = unit["name"], unit["width"], unit["height"]
+
+    if i in preview_rings:
+        preview_sink = f"appsink name=preview{i} emit-signals=true max-buffers=1 drop=true sync=false"
+    else:
+        preview_sink = f"""
+        multipartmux boundary=spionisto !
+        tcpclientsink port={unit["preview_port"]}
+        """
+
+    if i in recorders:
+        # encoded all the time for the pre-roll, written by the ClipRecorder around detections
+        recording_sink = f"appsink name=rec{i} emit-signals=true sync=false max-buffers=120 drop=true"
+    else:
+        recording_sink = f"""
+        avimux !
+        filesink location={os.path.join(RECORDINGS_DIR, f"{name}_{session}.avi")}
+        """
+
+    if unit.get("display"):
+        output = f"""
+        demux.src_{i} !
         nvvideoconvert !
         video/x-raw,format=RGBA !
         queue leaky=1 max-size-buffers=1 !
@@ -146,32 +324,81 @@ def main():
         textoverlay name=osd valignment=top halignment=left font-desc="Sans, 12" draw-outline=0 draw-shadow=0 color=0xFFFF0000 !
         nvvideoconvert !
         nvdrmvideosink name=drm-sink sync=false set-mode=1
+        """
+    else:
+        output = f"""
+        demux.src_{i} !
+        fakesink sync=false
+        """
+
+    return f"""
+        {source_desc(unit)} !
+        tee name=t{i}
+
+        t{i}. !
+        nvvideoconvert !
+        mux.sink_{i}
 
-        t. !
+        {output}
+
+        t{i}. !
         queue !
         nvvideoconvert !
-        nvjpegenc quality=70 !
+        nvjpegenc name=recenc{i} quality=70 !
         queue leaky=1 !
-        avimux !
-        filesink location=recording.avi
+        {recording_sink}
 
-        t. !
+        t{i}. !
         queue !
-        nvvideoconvert dest-crop=0:0:{int(WIDTH/4)}:{int(HEIGHT/4)} !
-        video/x-raw(memory:NVMM),width={int(WIDTH/4)},height={int(HEIGHT/4)} !
-        videorate !
-        video/x-raw(memory:NVMM),framerate=30/1 !
-        nvjpegenc quality=70 !
-        multipartmux boundary=spionisto !
-        tcpclientsink port=5001
+        nvvideoconvert dest-crop=0:0:{int(width/4)}:{int(height/4)} !
+        video/x-raw(memory:NVMM),width={int(width/4)},height={int(height/4)} !
+        videorate name=previewrate{i} drop-only=true max-rate=30 !
+        nvjpegenc name=previewenc{i} quality=70 !
+        {preview_sink}
+
+        {h264_preview_desc(i, unit) if unit.get("h264_preview") else ""}
     """
 
-    # convert avi -> mp4: ffmpeg -i recording.avi -vf "transpose=1" -c:v libx264 -pix_fmt yuv420p -preset veryfast -crf 21 -an output.mp4
-    pipeline = Gst.parse_launch(pipeline_desc)
+
+def pipeline_desc() -> str:
+    batch_size = len(units)
+    # all cameras are batched into a single inference call, the push timeout makes sure a
+    # stalled camera doesn't hold back the batch for longer than one frame
+    return f"""
+        nvstreammux name=mux width={WIDTH} height={HEIGHT} live-source=1 batch-size={batch_size} batched-push-timeout={int(1e6 / 60)} !
+        nvinfer name=infer config-file-path=pgie_config.txt batch-size={batch_size} model-engine-file=model_b{batch_size}_gpu0_fp16.engine !
+        nvstreamdemux name=demux
+    """ + "".join(unit_pipeline_desc(i, unit) for i, unit in enumerate(units))
+
+
+def main():
+    global pipeline, osd, glshader
+    global ipc_clients
+
+    logger.info("Trying to connect to IPC server...")
+    ipc_clients = [create_rocam_ipc_client(unit["ipc_port"]) for unit in units]
+    logger.info("Connected to IPC server.")
+
+    os.makedirs(RECORDINGS_DIR, exist_ok=True)
+    create_recorders()
+    for i, ipc_client in enumerate(ipc_clients):
+        threading.Thread(target=ipc_recv_loop, args=(i, ipc_client), name=f"ipc-recv-{i}", daemon=True).start()
+
+    Gst.init(None)
+
+    # recordings are converted to mp4 etc. by the export jobs of the backend (export_jobs.py)
+    open_preview_rings()
+    pipeline = Gst.parse_launch(pipeline_desc())
+
+    for i, ring in preview_rings.items():
+        pipeline.get_by_name(f"preview{i}").connect("new-sample", on_preview_sample, ring)
+    for i, recorder in recorders.items():
+        pipeline.get_by_name(f"rec{i}").connect("new-sample", on_recording_sample, recorder)
 
     glshader = pipeline.get_by_name("shader")
-    glshader.set_property('fragment', open("shader.frag").read())
-    glshader.set_property('uniforms', Gst.Structure.new_from_string("uniforms, tx=(float)0.0, ty=(float)0.0, scale=(float)1.0"))
+    if glshader:
+        glshader.set_property('fragment', open("shader.frag").read())
+        glshader.set_property('uniforms', Gst.Structure.new_from_string("uniforms, tx=(float)0.0, ty=(float)0.0, scale=(float)1.0"))
 
     # create an event loop and feed gstreamer bus mesages to it
     loop = GLib.MainLoop()
@@ -185,6 +412,10 @@ def main():
 
     osd = pipeline.get_by_name("osd")
 
+    # steps inference, preview and recording quality down when the board throttles or falls behind
+    if os.environ.get("ROCAM_GOVERNOR", "1") != "0":
+        GLib.timeout_add_seconds(1, governor_tick, Governor(apply_governor_level))
+
     print("Starting pipeline \n")
     pipeline.set_state(Gst.State.PLAYING)
     try:
@@ -193,8 +424,16 @@ def main():
         pass
     # cleanup
     pipeline.set_state(Gst.State.NULL)
+    for recorder in recorders.values():
+        recorder.close()
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1:
+        units = json.loads(sys.argv[1])
+    WIDTH = units[0]["width"]
+    HEIGHT = units[0]["height"]
+
     os.nice(-10)
     main()
@@ -0,0 +1,167 @@
+import mmap
+import os
+import struct
+import tempfile
+import time
+import zlib
+from typing import Callable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# the preview is a quarter resolution JPEG, usually a few tens of kB
+SLOT_COUNT = 4
+SLOT_SIZE = 512 * 1024
+
+_MAGIC = b"ROCAMPR2"
+# magic, slot count, slot size, sequence number of the newest complete frame (0: none yet)
+_HEADER = struct.Struct("<8sIIQ")
+_LATEST_OFFSET = 16
+# lock word, length, time.time() at which the frame was written, CRC-32 of the frame
+_SLOT_HEADER = struct.Struct("<QIdI")
+_ALIGN = 64
+
+def ring_path(unit_name: str) -> str:
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"rocam-preview-{unit_name}")
+
+def _ring_size(slot_count: int, slot_size: int) -> int:
+    return _ALIGN + slot_count * (_ALIGN + slot_size)
+
+class PreviewRing:
+    """
+    Preview JPEG frames shared between the cv process (one writer) and the backend (readers)
+    through a memory-mapped file, instead of a loopback TCP stream.
+
+    The file holds a fixed number of fixed-size slots, written round robin. Each slot starts with
+    a lock word used as a seqlock: the writer makes it odd (2 * seq - 1) before touching the slot
+    and sets it to 2 * seq once the frame is complete, then publishes seq as the newest frame in
+    the header. A reader checks the lock word before and after using the data, and retries if the
+    writer got to the slot in between. With several slots that only happens to a reader that is
+    more than slot_count - 1 frames behind.
+
+    Python has no memory barriers, and on a weakly ordered CPU (the Jetson's aarch64) a reader can
+    see the new lock word before the frame data it guards. So the slot header also holds the
+    frame's length and CRC-32, and a frame is only accepted if its CRC matches after the second
+    lock word check; a torn or stale frame is retried like an overwritten one.
+
+    Reading is plain memory access on the mapping, no syscalls, and the frame is handed to the
+    reader as a memoryview into the mapping rather than copied. Readers map the file read-only
+    and never create it: until the cv process has created the ring, there are no frames.
+    """
+
+    def __init__(self, path: str, slot_count: int = SLOT_COUNT, slot_size: int = SLOT_SIZE, writer: bool = False):
+        self.path = path
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self._writer = writer
+        self._mmap: Optional[mmap.mmap] = None
+        self._view: Optional[memoryview] = None
+        self._next_open_attempt = 0.0
+
+        size = _ring_size(slot_count, slot_size)
+        if not writer:
+            self._open_reader()
+            return
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._view = memoryview(self._mmap)
+
+        magic, count, slot_bytes, latest = _HEADER.unpack_from(self._mmap, 0)
+        if (magic, count, slot_bytes) != (_MAGIC, slot_count, slot_size):
+            # fresh file (or a different geometry): nothing in it is valid
+            self._mmap[:size] = bytes(size)
+            latest = 0
+            _HEADER.pack_into(self._mmap, 0, _MAGIC, slot_count, slot_size, 0)
+        # continue the sequence of a previous writer, so readers see the frames as new
+        self._seq = latest
+
+    def _open_reader(self) -> bool:
+        """Map the ring read-only if the cv process has created it. Retried at most once a second."""
+        now = time.monotonic()
+        if now < self._next_open_attempt:
+            return False
+        self._next_open_attempt = now + 1.0
+        size = _ring_size(self.slot_count, self.slot_size)
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            if os.fstat(fd).st_size < size:
+                # still being set up by the writer
+                return False
+            self._mmap = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        self._view = memoryview(self._mmap)
+        return True
+
+    def close(self):
+        if self._mmap is not None:
+            self._view.release()
+            self._mmap.close()
+
+    def _slot_offset(self, seq: int) -> int:
+        return _ALIGN + (seq % self.slot_count) * (_ALIGN + self.slot_size)
+
+    def write(self, jpeg, t: float) -> bool:
+        """Publish a frame. Returns False if it doesn't fit in a slot (the frame is dropped)."""
+        if len(jpeg) > self.slot_size:
+            return False
+        seq = self._seq + 1
+        offset = self._slot_offset(seq)
+        data = offset + _ALIGN
+
+        struct.pack_into("<Q", self._mmap, offset, 2 * seq - 1)
+        self._view[data:data + len(jpeg)] = jpeg
+        _SLOT_HEADER.pack_into(self._mmap, offset, 2 * seq - 1, len(jpeg), t, zlib.crc32(jpeg))
+        struct.pack_into("<Q", self._mmap, offset, 2 * seq)
+        struct.pack_into("<Q", self._mmap, _LATEST_OFFSET, seq)
+        self._seq = seq
+        return True
+
+    def latest_seq(self) -> int:
+        """
+        Sequence number of the newest frame, 0 if there is none (no producer yet, or the ring isn't
+        initialized).
+        """
+        if self._mmap is None and not self._open_reader():
+            return 0
+        magic, count, slot_bytes, latest = _HEADER.unpack_from(self._mmap, 0)
+        if (magic, count, slot_bytes) != (_MAGIC, self.slot_count, self.slot_size):
+            return 0
+        return latest
+
+    def read_latest(self, consume: Callable[[memoryview], T], retries: int = 3) -> Optional[Tuple[T, int, float]]:
+        """
+        Pass the newest frame to consume (e.g. base64.b64encode) and return (its result, the
+        frame's sequence number, the time it was written), or None if there is no frame.
+
+        The memoryview is only valid during the call: consume must not keep a reference to it.
+        """
+        for _ in range(retries + 1):
+            seq = self.latest_seq()
+            if seq == 0:
+                return None
+            offset = self._slot_offset(seq)
+            lock, length, t, crc = _SLOT_HEADER.unpack_from(self._mmap, offset)
+            if lock != 2 * seq or length > self.slot_size:
+                # overwritten since seq was published
+                continue
+            frame = self._view[offset + _ALIGN:offset + _ALIGN + length]
+            try:
+                result = consume(frame)
+                if struct.unpack_from("<Q", self._mmap, offset)[0] != lock:
+                    continue
+                # the lock word can become visible before the data it guards: check the bytes too
+                if zlib.crc32(frame) == crc:
+                    return result, seq, t
+            finally:
+                frame.release()
+        return None
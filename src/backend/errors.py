@@ -0,0 +1,5 @@
+class NotFound(LookupError):
+    """A request refers to a unit, recording or export job that doesn't exist. Served as a 404."""
+
+class InvalidRequest(ValueError):
+    """A request has invalid parameters, or can't be done in the current state. Served as a 400."""
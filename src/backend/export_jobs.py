@@ -0,0 +1,329 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict, field
+from typing import Optional
+
+from errors import InvalidRequest, NotFound
+from recordings import RECORDINGS_DIR, recording_path, is_active
+
+logger = logging.getLogger(__name__)
+
+EXPORTS_DIR = os.path.join(RECORDINGS_DIR, "exports")
+
+# recordings are encoded in chunks, so a job interrupted by a cancel or a restart of the backend
+# resumes from the last finished chunk instead of starting over
+CHUNK_S = 30.0
+
+ROTATIONS = {
+    0: None,
+    90: "transpose=1",
+    180: "transpose=1,transpose=1",
+    270: "transpose=2",
+}
+
+FORMATS = {
+    "mp4": ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-preset", "veryfast", "-crf", "21"],
+    "mkv": ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-preset", "veryfast", "-crf", "21"],
+    "webm": ["-c:v", "libvpx-vp9", "-pix_fmt", "yuv420p", "-b:v", "0", "-crf", "32", "-row-mt", "0"],
+}
+
+@dataclass
+class ExportJob:
+    """
+    Export of a finished recording, optionally rotated and trimmed to [start_s, end_s)
+    (in seconds of pts from the start of the recording).
+
+    state: "queued", "running", "done", "failed" or "canceled"
+    """
+    id: str
+    recording: str
+    rotation: int
+    format: str
+    start_s: float
+    end_s: Optional[float]
+    state: str = "queued"
+    progress: float = 0.0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    chunks_done: int = 0
+
+    @property
+    def work_dir(self) -> str:
+        return os.path.join(EXPORTS_DIR, self.id)
+
+    @property
+    def output_name(self) -> str:
+        return f"{os.path.splitext(self.recording)[0]}_{self.id}.{self.format}"
+
+    @property
+    def output_path(self) -> str:
+        return os.path.join(EXPORTS_DIR, self.output_name)
+
+def probe_duration(path: str) -> float:
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return float(out.strip())
+
+def _low_priority_prefix(cores: Optional[set[int]]) -> list[str]:
+    """
+    Command prefix that starts a process at the lowest CPU and I/O priority, restricted to the given
+    cores. Done with wrapper commands rather than a preexec_fn, which isn't safe to run between
+    fork and exec in a process with this many threads.
+    """
+    prefix = []
+    if shutil.which("ionice"):
+        prefix += ["ionice", "-c3"]
+    if cores and shutil.which("taskset"):
+        prefix += ["taskset", "-c", ",".join(str(core) for core in sorted(cores))]
+    if shutil.which("nice"):
+        prefix += ["nice", "-n", "19"]
+    return prefix
+
+class ExportQueue:
+    """
+    Runs export jobs in the background as ffmpeg processes.
+
+    Every job runs as an ffmpeg child process that is niced to 19, pinned to a subset of the CPU
+    cores and limited to one encoder thread (plus ionice idle class when available), so exports
+    never starve the live pipeline. The job list is persisted to jobs.json in EXPORTS_DIR, and
+    unfinished jobs are picked up again when the backend restarts.
+    """
+
+    def __init__(self, max_workers: int = 1, cores: Optional[set[int]] = None):
+        if cores is None:
+            # leave the other cores to the capture pipeline and the backend
+            cores = {os.cpu_count() - 1}
+        self._cores = cores
+        self._lock = threading.Lock()
+        self._jobs: dict[str, ExportJob] = {}
+        self._processes: dict[str, subprocess.Popen] = {}
+        # bumped by every cancel and resume: a run only acts on its job while its generation is current
+        self._generations: dict[str, int] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="export")
+
+        os.makedirs(EXPORTS_DIR, exist_ok=True)
+        self._load()
+
+    # ── persistence ────────────────────────────────────────────────────────────
+    def _jobs_file(self) -> str:
+        return os.path.join(EXPORTS_DIR, "jobs.json")
+
+    def _load(self):
+        if not os.path.isfile(self._jobs_file()):
+            return
+        try:
+            with open(self._jobs_file()) as f:
+                jobs = [ExportJob(**d) for d in json.load(f)]
+        except Exception as e:
+            logger.error(f"Failed to load export jobs: {e}")
+            return
+
+        for job in jobs:
+            self._jobs[job.id] = job
+            if job.state in ("queued", "running"):
+                logger.info(f"Resuming export job {job.id}")
+                job.state = "queued"
+                self._executor.submit(self._run, job.id, 0)
+
+    def _save(self):
+        # must be called with self._lock held
+        tmp = self._jobs_file() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump([asdict(job) for job in self._jobs.values()], f, indent=2)
+        os.replace(tmp, self._jobs_file())
+
+    # ── API ────────────────────────────────────────────────────────────────────
+    def submit(self, recording: str, rotation: int = 90, format: str = "mp4",
+               start_s: float = 0.0, end_s: Optional[float] = None) -> ExportJob:
+        """
+        Queue an export job.
+
+        Raises:
+          NotFound if the recording doesn't exist.
+          InvalidRequest on invalid parameters or if the recording is still being recorded.
+        """
+        path = recording_path(recording)
+        if is_active(path):
+            raise InvalidRequest("Recording is still in progress")
+        if rotation not in ROTATIONS:
+            raise InvalidRequest(f"Unsupported rotation: {rotation}")
+        if format not in FORMATS:
+            raise InvalidRequest(f"Unsupported format: {format}")
+        if start_s < 0 or (end_s is not None and end_s <= start_s):
+            raise InvalidRequest("Invalid trim range")
+
+        job = ExportJob(id=uuid.uuid4().hex[:12], recording=recording, rotation=rotation, format=format,
+                        start_s=float(start_s), end_s=None if end_s is None else float(end_s))
+        with self._lock:
+            self._jobs[job.id] = job
+            self._save()
+        self._executor.submit(self._run, job.id, 0)
+        return job
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.state in ("queued", "running"))
+
+    def jobs(self) -> list[dict]:
+        with self._lock:
+            return [self._describe(job) for job in sorted(self._jobs.values(), key=lambda j: j.created_at)]
+
+    def status(self, job_id: str) -> dict:
+        with self._lock:
+            return self._describe(self._get(job_id))
+
+    def cancel(self, job_id: str):
+        """Stop a queued or running job. Finished chunks are kept so the job can be resumed."""
+        with self._lock:
+            job = self._get(job_id)
+            if job.state not in ("queued", "running"):
+                return
+            self._generations[job_id] = self._generations.get(job_id, 0) + 1
+            job.state = "canceled"
+            self._save()
+            p = self._processes.get(job_id)
+        if p:
+            p.kill()
+
+    def resume(self, job_id: str):
+        """Re-queue a canceled or failed job, continuing after its last finished chunk."""
+        with self._lock:
+            job = self._get(job_id)
+            if job.state not in ("canceled", "failed"):
+                return
+            generation = self._generations[job_id] = self._generations.get(job_id, 0) + 1
+            job.state = "queued"
+            job.error = None
+            self._save()
+        self._executor.submit(self._run, job_id, generation)
+
+    def output_path(self, job_id: str) -> str:
+        with self._lock:
+            job = self._get(job_id)
+            if job.state != "done":
+                raise NotFound(f"Export {job_id} is not done")
+            return job.output_path
+
+    def _get(self, job_id: str) -> ExportJob:
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise NotFound(f"Unknown export job: {job_id}")
+        return job
+
+    @staticmethod
+    def _describe(job: ExportJob) -> dict:
+        d = asdict(job)
+        d["output"] = job.output_name if job.state == "done" else None
+        return d
+
+    # ── worker ─────────────────────────────────────────────────────────────────
+    def _stale(self, job_id: str, generation: int) -> bool:
+        # must be called with self._lock held
+        return self._generations.get(job_id, 0) != generation
+
+    def _ffmpeg(self, job_id: str, generation: int, args: list[str], on_progress=None):
+        """Run ffmpeg at low priority, reporting the encoded duration in seconds to on_progress."""
+        cmd = (_low_priority_prefix(self._cores)
+               + ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostats", "-progress", "pipe:1", "-y"] + args)
+
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        with self._lock:
+            if self._stale(job_id, generation):
+                # canceled while starting
+                p.kill()
+            else:
+                self._processes[job_id] = p
+        try:
+            for line in p.stdout:
+                key, _, value = line.strip().partition("=")
+                if key == "out_time_us" and on_progress and value.isdigit():
+                    on_progress(int(value) / 1e6)
+            stderr = p.stderr.read()
+            p.wait()
+        finally:
+            with self._lock:
+                if self._processes.get(job_id) is p:
+                    del self._processes[job_id]
+
+        if p.returncode != 0:
+            raise RuntimeError(stderr.strip() or f"ffmpeg exited with {p.returncode}")
+
+    def _set(self, job: ExportJob, generation: int, **changes) -> bool:
+        """Update a job from one of its runs. Returns False (and changes nothing) if the run is stale."""
+        with self._lock:
+            if self._stale(job.id, generation):
+                return False
+            for k, v in changes.items():
+                setattr(job, k, v)
+            self._save()
+            return True
+
+    def _run(self, job_id: str, generation: int):
+        with self._lock:
+            job = self._jobs[job_id]
+            if job.state != "queued" or self._stale(job_id, generation):
+                return
+            job.state = "running"
+            self._save()
+
+        try:
+            src = recording_path(job.recording)
+            duration_s = probe_duration(src)
+            end_s = duration_s if job.end_s is None else min(job.end_s, duration_s)
+            total_s = max(end_s - job.start_s, 1e-6)
+            n_chunks = max(1, int((total_s + CHUNK_S - 1e-6) // CHUNK_S))
+            os.makedirs(job.work_dir, exist_ok=True)
+
+            filters = ROTATIONS[job.rotation]
+            parts = []
+            for i in range(n_chunks):
+                part = os.path.join(job.work_dir, f"part_{i:04d}.{job.format}")
+                parts.append(part)
+                if i < job.chunks_done and os.path.isfile(part):
+                    continue
+                with self._lock:
+                    if self._stale(job_id, generation):
+                        logger.info(f"Export job {job.id} canceled")
+                        return
+
+                chunk_start = job.start_s + i * CHUNK_S
+                chunk_len = min(CHUNK_S, end_s - chunk_start)
+                tmp = os.path.join(job.work_dir, f"part_{i:04d}.tmp.{job.format}")
+
+                def on_progress(encoded_s, i=i):
+                    job.progress = min(0.99, (i * CHUNK_S + encoded_s) / total_s)
+
+                self._ffmpeg(job.id, generation,
+                             ["-ss", f"{chunk_start:.3f}", "-i", src, "-t", f"{chunk_len:.3f}", "-an", "-threads", "1"]
+                             + (["-vf", filters] if filters else [])
+                             + FORMATS[job.format] + [tmp],
+                             on_progress)
+                # only complete chunks get their final name
+                os.replace(tmp, part)
+                self._set(job, generation, chunks_done=i + 1, progress=min(0.99, (i + 1) * CHUNK_S / total_s))
+
+            concat_list = os.path.join(job.work_dir, "parts.txt")
+            with open(concat_list, "w") as f:
+                f.writelines(f"file '{os.path.basename(part)}'\n" for part in parts)
+            faststart = ["-movflags", "+faststart"] if job.format == "mp4" else []
+            self._ffmpeg(job.id, generation, ["-f", "concat", "-safe", "0", "-i", concat_list, "-c", "copy"] + faststart
+                         + [job.output_path])
+
+            if self._set(job, generation, state="done", progress=1.0):
+                shutil.rmtree(job.work_dir, ignore_errors=True)
+                logger.info(f"Export job {job.id} done: {job.output_path}")
+        except Exception as e:
+            # a canceled (and possibly resumed) job belongs to a newer run, whatever this one ran into
+            if not self._set(job, generation, state="failed", error=str(e)):
+                logger.info(f"Export job {job.id} canceled")
+            else:
+                logger.error(f"Export job {job.id} failed: {e}")
@@ -1,4 +1,5 @@
 import struct
+import time
 import serial
 from typing import Optional, Tuple
 from threading import Lock
@@ -248,6 +249,68 @@ class GimbalSerial:
             pan = struct.unpack("<f", resp[4:8])[0]
             return tilt, pan
 
+class EmulatedGimbal:
+    """
+    Drop-in stand-in for GimbalSerial that needs no hardware.
+
+    The emulated servos slew towards the last commanded angle at a fixed rate
+    (degrees per second), which is enough to exercise tracking and multi-unit
+    setups on a workstation.
+    """
+
+    def __init__(self, slew_rate_dps: float = 300.0, tilt: float = 0.0, pan: float = 0.0):
+        self._slew_rate_dps = slew_rate_dps
+        self._mutex = Lock()
+        self._target = (tilt, pan)
+        self._position = (tilt, pan)
+        self._last_update = time.monotonic()
+        self.arm_led_state = False
+        self.status_led_state = False
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _update(self):
+        # must be called with self._mutex held
+        now = time.monotonic()
+        max_step = self._slew_rate_dps * (now - self._last_update)
+        self._last_update = now
+        self._position = tuple(
+            p + max(-max_step, min(max_step, t - p))
+            for p, t in zip(self._position, self._target)
+        )
+
+    def arm_led(self, state: bool) -> bool:
+        self.arm_led_state = state
+        return True
+
+    def status_led(self, state: bool) -> bool:
+        self.status_led_state = state
+        return True
+
+    def move_deg(self, tilt: float, pan: float) -> bool:
+        with self._mutex:
+            self._update()
+            self._target = (float(tilt), float(pan))
+        return True
+
+    def measure_deg(self) -> Tuple[float, float]:
+        with self._mutex:
+            self._update()
+            return self._position
+
+def create_gimbal(port: str, baudrate: int = 115200, timeout: float = 0.1):
+    """Open the gimbal on the given serial port, or an EmulatedGimbal if port is "emulated"."""
+    if port == "emulated":
+        return EmulatedGimbal()
+    return GimbalSerial(port=port, baudrate=baudrate, timeout=timeout)
+
 if __name__ == "__main__":
     # gimbal = GimbalSerial(port="/dev/ttyTHS1", baudrate=115200, timeout=0.5)
     with GimbalSerial(port="/dev/ttyTHS1", baudrate=115200, timeout=0.5) as dev:
@@ -0,0 +1,237 @@
+import queue
+import socket
+import struct
+import threading
+import logging
+from typing import Iterator, Optional
+
+from errors import InvalidRequest
+
+logger = logging.getLogger(__name__)
+
+# sample_is_non_sync_sample in the ISO BMFF sample flags
+_NON_SYNC_SAMPLE = 0x10000
+
+def _boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[tuple[bytes, int, int]]:
+    """(type, payload start, box end) of the boxes in data[start:end]."""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield box_type, pos + header, pos + size
+        pos += size
+
+def _first_sample_is_sync(moof: bytes) -> bool:
+    """Whether a fragment starts with a keyframe, from the sample flags of its first track run."""
+    for box_type, start, end in _boxes(moof):
+        if box_type != b"moof":
+            continue
+        for traf_type, traf_start, traf_end in _boxes(moof, start, end):
+            if traf_type != b"traf":
+                continue
+            default_flags = None
+            for child, child_start, _ in _boxes(moof, traf_start, traf_end):
+                if child == b"tfhd":
+                    flags = struct.unpack_from(">I", moof, child_start)[0] & 0xFFFFFF
+                    pos = child_start + 8  # version/flags, track id
+                    for bit, size in ((0x1, 8), (0x2, 4), (0x8, 4), (0x10, 4)):
+                        if flags & bit:
+                            pos += size
+                    if flags & 0x20:
+                        default_flags = struct.unpack_from(">I", moof, pos)[0]
+                elif child == b"trun":
+                    flags = struct.unpack_from(">I", moof, child_start)[0] & 0xFFFFFF
+                    pos = child_start + 8  # version/flags, sample count
+                    if flags & 0x1:
+                        pos += 4  # data offset
+                    if flags & 0x4:
+                        sample_flags = struct.unpack_from(">I", moof, pos)[0]
+                    elif flags & 0x400:
+                        # per sample fields: duration, size, flags, composition offset
+                        pos += 4 * bool(flags & 0x100) + 4 * bool(flags & 0x200)
+                        sample_flags = struct.unpack_from(">I", moof, pos)[0]
+                    elif default_flags is not None:
+                        sample_flags = default_flags
+                    else:
+                        return True
+                    return not sample_flags & _NON_SYNC_SAMPLE
+    return False
+
+def _codec(init: bytes) -> Optional[str]:
+    """RFC 6381 codec string (e.g. avc1.42C01F) from the avcC box of an init segment."""
+    i = init.find(b"avcC")
+    if i < 0 or i + 8 > len(init):
+        return None
+    profile, compat, level = init[i + 5:i + 8]
+    return f"avc1.{profile:02X}{compat:02X}{level:02X}"
+
+class _Viewer:
+    def __init__(self, max_fragments: int):
+        self.fragments: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=max_fragments)
+        # after falling behind, wait for a keyframe before sending anything else
+        self.waiting_for_keyframe = False
+
+class Fmp4PreviewRelay:
+    """
+    Receives the fragmented MP4 H.264 preview of a unit from the cv process (a TCP stream of
+    ftyp + moov followed by moof + mdat fragments) and relays it to any number of browsers, which
+    play it with Media Source Extensions. The stream is encoded once, whatever the number of viewers.
+
+    A new viewer gets the init segment and the fragments since the last keyframe, so it can start
+    decoding right away. A viewer that can't keep up (slow link) has its backlog dropped and resumes
+    at the next keyframe, instead of holding back the others or buffering without bound.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 5100, max_viewer_fragments: int = 30):
+        self._max_viewer_fragments = max_viewer_fragments
+        self._lock = threading.Lock()
+        self._init: Optional[bytes] = None
+        # fragments since (and including) the last keyframe
+        self._gop: list[bytes] = []
+        self._viewers: set[_Viewer] = set()
+
+        self._server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server_sock.bind((host, port))
+        self._server_sock.listen()
+
+        threading.Thread(target=self._run, name=f"fmp4-relay-{port}", daemon=True).start()
+
+    @property
+    def codec(self) -> Optional[str]:
+        init = self._init
+        return _codec(init) if init else None
+
+    def viewer_count(self) -> int:
+        with self._lock:
+            return len(self._viewers)
+
+    def _run(self):
+        while True:
+            sd, addr = self._server_sock.accept()
+            logger.info(f"Accepted H.264 preview stream from {addr}")
+            try:
+                self._handle_connection(sd)
+            except OSError as e:
+                logger.warning(f"H.264 preview stream error: {e}")
+            finally:
+                sd.close()
+                logger.info(f"Lost H.264 preview stream from {addr}")
+                # the next connection starts a new stream, with a new init segment
+                self._reset()
+
+    def _reset(self):
+        with self._lock:
+            self._init = None
+            self._gop = []
+            for viewer in self._viewers:
+                self._close_viewer(viewer)
+            self._viewers.clear()
+
+    def _handle_connection(self, sd: socket.socket):
+        f = sd.makefile("rb")
+        init = b""
+        moof = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return
+            size, box_type = struct.unpack(">I4s", header)
+            if size == 1:
+                large = f.read(8)
+                header += large
+                size = struct.unpack(">Q", large)[0]
+            if size < len(header):
+                logger.error(f"Invalid box in H.264 preview stream: {box_type!r} of size {size}")
+                return
+            box = header + f.read(size - len(header))
+            if len(box) < size:
+                return
+
+            if box_type in (b"ftyp", b"moov"):
+                init += box
+                if box_type == b"moov":
+                    with self._lock:
+                        self._init = init
+                    init = b""
+            elif box_type == b"moof":
+                moof = box
+            elif box_type == b"mdat" and moof is not None:
+                self._publish(moof + box, _first_sample_is_sync(moof))
+                moof = None
+
+    def _publish(self, fragment: bytes, keyframe: bool):
+        with self._lock:
+            if keyframe:
+                self._gop = [fragment]
+            elif self._gop:
+                self._gop.append(fragment)
+
+            for viewer in self._viewers:
+                if viewer.waiting_for_keyframe:
+                    if not keyframe:
+                        continue
+                    viewer.waiting_for_keyframe = False
+                try:
+                    viewer.fragments.put_nowait(fragment)
+                except queue.Full:
+                    self._drop_backlog(viewer)
+                    viewer.waiting_for_keyframe = True
+
+    @staticmethod
+    def _drop_backlog(viewer: _Viewer):
+        try:
+            while True:
+                viewer.fragments.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _close_viewer(self, viewer: _Viewer):
+        self._drop_backlog(viewer)
+        viewer.fragments.put_nowait(None)
+
+    def stream(self, timeout_s: float = 5.0) -> Iterator[bytes]:
+        """
+        The preview as a continuous fMP4 byte stream for one viewer, starting with the init
+        segment. Ends when the cv process stream ends or no fragment arrives for timeout_s.
+
+        Raises:
+          InvalidRequest if there is no stream yet.
+        """
+        if self._init is None:
+            raise InvalidRequest("The H.264 preview isn't streaming")
+        return self._iterate(timeout_s)
+
+    def _iterate(self, timeout_s: float) -> Iterator[bytes]:
+        # the viewer is only registered once the response body is consumed, inside the try, so it is
+        # always removed again: a generator that is never started never runs its finally
+        viewer = _Viewer(self._max_viewer_fragments)
+        try:
+            with self._lock:
+                if self._init is None:
+                    # the stream ended in the meantime
+                    return
+                first = [self._init] + self._gop
+                if not self._gop:
+                    viewer.waiting_for_keyframe = True
+                self._viewers.add(viewer)
+
+            yield from first
+            while True:
+                fragment = viewer.fragments.get(timeout=timeout_s)
+                if fragment is None:
+                    return
+                yield fragment
+        except queue.Empty:
+            return
+        finally:
+            with self._lock:
+                self._viewers.discard(viewer)
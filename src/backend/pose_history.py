@@ -0,0 +1,83 @@
+import threading
+from bisect import bisect_left
+from collections import deque
+from typing import Callable, Optional, Tuple
+
+class _Series:
+    """Time-ordered (t, tilt, pan) samples, trimmed to a maximum age."""
+
+    def __init__(self, max_age_s: float):
+        self._max_age_s = max_age_s
+        self._t: deque[float] = deque()
+        self._angles: deque[Tuple[float, float]] = deque()
+
+    def append(self, t: float, tilt: float, pan: float):
+        if self._t and t < self._t[-1]:
+            # out of order sample (e.g. from a slow serial read), ignore
+            return
+        self._t.append(t)
+        self._angles.append((tilt, pan))
+        while self._t and self._t[0] < t - self._max_age_s:
+            self._t.popleft()
+            self._angles.popleft()
+
+    def at(self, t: float) -> Optional[Tuple[float, float]]:
+        """Linearly interpolated angles at time t, or None if t is outside the recorded range."""
+        if not self._t or t < self._t[0] or t > self._t[-1]:
+            return None
+
+        i = bisect_left(self._t, t)
+        if self._t[i] == t:
+            return self._angles[i]
+
+        t0, t1 = self._t[i - 1], self._t[i]
+        (tilt0, pan0), (tilt1, pan1) = self._angles[i - 1], self._angles[i]
+        w = (t - t0) / (t1 - t0)
+        return tilt0 + w * (tilt1 - tilt0), pan0 + w * (pan1 - pan0)
+
+    def latest(self) -> Optional[Tuple[float, Tuple[float, float]]]:
+        if not self._t:
+            return None
+        return self._t[-1], self._angles[-1]
+
+class PoseHistory:
+    """
+    Timestamped history of the gimbal angles, both commanded and measured, so that a detection
+    can be related to where the camera was pointing when the frame was captured rather than
+    where it is pointing now.
+
+    All times are time.monotonic() seconds. on_measured(t, tilt, pan) is called with every
+    measurement, e.g. to publish the latest angles.
+    """
+
+    def __init__(self, max_age_s: float = 2.0, on_measured: Optional[Callable[[float, float, float], None]] = None):
+        self._on_measured = on_measured
+        self._lock = threading.Lock()
+        self._commanded = _Series(max_age_s)
+        self._measured = _Series(max_age_s)
+
+    def record_commanded(self, t: float, tilt: float, pan: float):
+        with self._lock:
+            self._commanded.append(t, tilt, pan)
+
+    def record_measured(self, t: float, tilt: float, pan: float):
+        with self._lock:
+            self._measured.append(t, tilt, pan)
+        if self._on_measured:
+            self._on_measured(t, tilt, pan)
+
+    def commanded_at(self, t: float) -> Optional[Tuple[float, float]]:
+        with self._lock:
+            return self._commanded.at(t)
+
+    def measured_at(self, t: float) -> Optional[Tuple[float, float]]:
+        with self._lock:
+            return self._measured.at(t)
+
+    def latest_measured(self, max_age_s: float, now: float) -> Optional[Tuple[float, float]]:
+        """The most recent measured angles if they are not older than max_age_s."""
+        with self._lock:
+            latest = self._measured.latest()
+        if latest is None or now - latest[0] > max_age_s:
+            return None
+        return latest[1]
@@ -3,9 +3,13 @@ import threading
 from select import select
 import time
 
+from cv_process.preview_ring import PreviewRing
+
 class MjpegFrameReceiver:
-    def __init__(self, host="127.0.0.1", port=5001, boundary="spionisto"):
+    def __init__(self, host="127.0.0.1", port=5001, boundary="spionisto", on_frame=None):
+        """on_frame(jpeg, recv_time) is called from the receiver thread with every frame."""
         self._host = host
+        self._on_frame = on_frame
         self._port = port
         self._boundary_str = boundary
         self._boundary_bytes = b"--" + boundary.encode("ascii")
@@ -19,7 +23,7 @@ class MjpegFrameReceiver:
         self._server_sock.bind((self._host, self._port))
         self._server_sock.listen()
 
-        threading.Thread(target=self._run, daemon=True).start()
+        threading.Thread(target=self._run, name=f"mjpeg-receiver-{port}", daemon=True).start()
 
 
     def get_latest_frame(self):
@@ -124,6 +128,41 @@ class MjpegFrameReceiver:
         jpeg_data = part[header_end + offset :]
 
         # Store latest frame atomically
+        recv_time = time.time()
         with self._lock:
             self._latest_frame = jpeg_data
-            self._latest_frame_recv_time = time.time()
+            self._latest_frame_recv_time = recv_time
+        if self._on_frame:
+            self._on_frame(jpeg_data, recv_time)
+
+
+class ShmFrameReceiver:
+    """
+    Picks up new frames from the shared memory preview ring written by the cv process.
+
+    Polling only reads the ring header from the mapping, so it costs no syscalls while there is no
+    new frame. Each new frame is passed through transform (e.g. base64 encoding) straight from the
+    mapping, and on_frame(transform(jpeg), frame_time) is called once the frame is known not to
+    have been overwritten meanwhile.
+    """
+
+    def __init__(self, path: str, on_frame, transform=bytes, poll_interval_s=0.005):
+        self._ring = PreviewRing(path)
+        self._on_frame = on_frame
+        self._transform = transform
+        self._poll_interval_s = poll_interval_s
+
+        threading.Thread(target=self._run, name=f"shm-receiver-{path.rsplit('/', 1)[-1]}", daemon=True).start()
+
+    def _run(self):
+        last_seq = 0
+        while True:
+            time.sleep(self._poll_interval_s)
+            # the cv process restarts its sequence when the ring is reset, so only compare for change
+            if self._ring.latest_seq() == last_seq:
+                continue
+            result = self._ring.read_latest(self._transform)
+            if result is None:
+                continue
+            frame, last_seq, frame_time = result
+            self._on_frame(frame, frame_time)
@@ -0,0 +1,180 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import logging
+from collections import Counter
+from typing import Callable, Optional
+
+from errors import InvalidRequest
+
+logger = logging.getLogger(__name__)
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+# ── Queue depths ───────────────────────────────────────────────────────────────
+_queues: dict[str, Callable[[], int]] = {}
+
+def register_queue(name: str, depth: Callable[[], int]):
+    """Register a queue (or anything with a depth) to be reported by the threads endpoint."""
+    _queues[name] = depth
+
+def queue_depths() -> dict[str, Optional[int]]:
+    depths = {}
+    for name, depth in list(_queues.items()):
+        try:
+            depths[name] = depth()
+        except Exception:
+            depths[name] = None
+    return depths
+
+# ── Sampling profiler ──────────────────────────────────────────────────────────
+_profile_lock = threading.Lock()
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def sample_stacks(duration_s: float, interval_s: float = 0.005) -> Counter:
+    """
+    Sample the Python stacks of all threads every interval_s for duration_s.
+
+    Returns a Counter of collapsed stacks ("thread;outer;...;inner" -> samples). Only one
+    profile can run at a time.
+
+    Raises:
+      InvalidRequest if a profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise InvalidRequest("A profile is already running")
+    try:
+        me = threading.get_ident()
+        stacks = Counter()
+        end = time.monotonic() + duration_s
+        while time.monotonic() < end:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(stack))] += 1
+            time.sleep(interval_s)
+        return stacks
+    finally:
+        _profile_lock.release()
+
+def collapsed(stacks: Counter) -> str:
+    """Collapsed stack format, as consumed by flamegraph.pl, inferno or speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+def sample_process(pid: int, duration_s: float, rate_hz: int = 200) -> str:
+    """
+    Collapsed stacks of another Python process (e.g. the cv process), sampled with py-spy.
+
+    Raises:
+      RuntimeError if py-spy isn't installed or fails.
+    """
+    py_spy = shutil.which("py-spy")
+    if py_spy is None:
+        raise RuntimeError("py-spy is not installed")
+
+    with tempfile.NamedTemporaryFile(suffix=".txt") as out:
+        result = subprocess.run(
+            [py_spy, "record", "--pid", str(pid), "--duration", str(max(1, int(round(duration_s)))),
+             "--rate", str(rate_hz), "--format", "raw", "--threads", "--nonblocking", "--output", out.name],
+            capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or f"py-spy exited with {result.returncode}")
+        with open(out.name) as f:
+            return f.read()
+
+# ── Continuous thread accounting ───────────────────────────────────────────────
+def _thread_cpu_s(native_id: int) -> Optional[float]:
+    try:
+        with open(f"/proc/self/task/{native_id}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # the thread name can contain spaces, fields after it are fixed
+    fields = stat[stat.rindex(")") + 2:].split()
+    utime, stime = int(fields[11]), int(fields[12])
+    return (utime + stime) / _CLOCK_TICKS
+
+class ThreadMonitor:
+    """
+    Keeps per-thread CPU usage and a GIL contention estimate up to date in the background.
+
+    The GIL estimate is how late the monitor thread wakes up from a short sleep: a thread that
+    wants to run Python code after sleeping has to wait for the GIL, so the extra latency (on top
+    of the scheduler's, which is small on an idle core) approximates the GIL wait of any thread.
+    """
+
+    def __init__(self, interval_s: float = 1.0, probe_sleep_s: float = 0.001):
+        self._interval_s = interval_s
+        self._probe_sleep_s = probe_sleep_s
+        self._lock = threading.Lock()
+        self._threads: dict[int, dict] = {}
+        self._gil_wait_avg_s = 0.0
+        self._gil_wait_max_s = 0.0
+        threading.Thread(target=self._run, name="thread-monitor", daemon=True).start()
+
+    def _probe_gil(self):
+        waits = []
+        end = time.monotonic() + self._interval_s
+        while time.monotonic() < end:
+            start = time.perf_counter()
+            time.sleep(self._probe_sleep_s)
+            waits.append(max(0.0, time.perf_counter() - start - self._probe_sleep_s))
+            time.sleep(0.05)
+        return waits
+
+    def _run(self):
+        last_cpu: dict[int, float] = {}
+        last_time = time.monotonic()
+        while True:
+            waits = self._probe_gil()
+
+            now = time.monotonic()
+            elapsed = now - last_time
+            last_time = now
+
+            threads = {}
+            for t in threading.enumerate():
+                if t.native_id is None:
+                    continue
+                cpu = _thread_cpu_s(t.native_id)
+                if cpu is None:
+                    continue
+                prev = last_cpu.get(t.native_id, cpu)
+                last_cpu[t.native_id] = cpu
+                threads[t.native_id] = {
+                    "name": t.name,
+                    "native_id": t.native_id,
+                    "daemon": t.daemon,
+                    "cpu_s": cpu,
+                    "cpu_percent": 100.0 * (cpu - prev) / elapsed if elapsed > 0 else 0.0,
+                }
+
+            with self._lock:
+                self._threads = threads
+                if waits:
+                    self._gil_wait_avg_s = sum(waits) / len(waits)
+                    self._gil_wait_max_s = max(waits)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "threads": sorted(self._threads.values(), key=lambda t: -t["cpu_percent"]),
+                "gil_wait_avg_ms": self._gil_wait_avg_s * 1000,
+                "gil_wait_max_ms": self._gil_wait_max_s * 1000,
+                "switch_interval_ms": sys.getswitchinterval() * 1000,
+                "queues": queue_depths(),
+            }
@@ -0,0 +1,104 @@
+import os
+import time
+import logging
+
+from errors import NotFound
+
+logger = logging.getLogger(__name__)
+
+# written by the cv process, one file per unit per pipeline start: <unit>_<YYYYmmdd-HHMMSS>.avi
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")
+
+# a recording that was written to this recently is still being recorded
+ACTIVE_TIMEOUT_S = 5.0
+
+def recording_path(name: str) -> str:
+    """
+    Absolute path of a recording by file name.
+
+    Raises:
+      NotFound if there is no such recording (names with path components are rejected).
+    """
+    if os.path.basename(name) != name or not name.endswith(".avi"):
+        raise NotFound(f"Unknown recording: {name}")
+    path = os.path.join(RECORDINGS_DIR, name)
+    if not os.path.isfile(path):
+        raise NotFound(f"Unknown recording: {name}")
+    return path
+
+def is_active(path: str) -> bool:
+    return time.time() - os.path.getmtime(path) < ACTIVE_TIMEOUT_S
+
+def list_recordings() -> list[dict]:
+    if not os.path.isdir(RECORDINGS_DIR):
+        return []
+
+    recordings = []
+    for entry in os.scandir(RECORDINGS_DIR):
+        if not entry.is_file() or not entry.name.endswith(".avi"):
+            continue
+        stat = entry.stat()
+        unit, _, session = entry.name[:-len(".avi")].rpartition("_")
+        recordings.append({
+            "name": entry.name,
+            "unit": unit,
+            "session": session,
+            "size": stat.st_size,
+            "modified": stat.st_mtime,
+            "active": time.time() - stat.st_mtime < ACTIVE_TIMEOUT_S,
+        })
+
+    recordings.sort(key=lambda r: r["modified"], reverse=True)
+    return recordings
+
+def events_path(recording_file: str) -> str:
+    return recording_file + ".events"
+
+def read_events(recording_file: str) -> list[float]:
+    """Times (seconds from the start of the recording) at which detections started."""
+    path = events_path(recording_file)
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        return [float(line) for line in f if line.strip()]
+
+def active_recording(unit: str) -> str | None:
+    """Path of the recording currently being written for a unit, if any."""
+    for recording in list_recordings():
+        if recording["unit"] == unit and recording["active"]:
+            return os.path.join(RECORDINGS_DIR, recording["name"])
+    return None
+
+class DetectionEventLog:
+    """
+    Records when detections start in a unit's current recording, so the recordings can be
+    scrubbed by detection events. A detection after more than gap_s without one starts a new event.
+
+    Detection pts are in pipeline running time, which starts with the recording.
+    """
+
+    def __init__(self, unit: str, gap_s: float = 1.0):
+        self._unit = unit
+        self._gap_s = gap_s
+        self._last_pts_s: float | None = None
+        self._recording: str | None = None
+        self._recording_checked_at = 0.0
+
+    def on_detection(self, pts_s: float):
+        last, self._last_pts_s = self._last_pts_s, pts_s
+        # pts going backwards means the pipeline (and so the recording) restarted
+        if last is not None and last <= pts_s < last + self._gap_s:
+            return
+
+        now = time.monotonic()
+        if self._recording is None or now - self._recording_checked_at > ACTIVE_TIMEOUT_S:
+            self._recording = active_recording(self._unit)
+            self._recording_checked_at = now
+        if self._recording is None:
+            return
+
+        try:
+            with open(events_path(self._recording), "a") as f:
+                f.write(f"{pts_s:.3f}\n")
+        except OSError as e:
+            logger.error(f"Failed to write detection event: {e}")
@@ -0,0 +1,268 @@
+"""
+Offline reprocessing of recordings: runs the detector and the tracker over every frame of past
+sessions, to compare a new model or new tracker settings against real flights.
+
+    python reprocess.py [--model models/model.pt.onnx] [--workers N] [recording.avi ...]
+
+Detection is the expensive part and is spread over a process pool in chunks of frames; the
+tracker is replayed afterwards over the detections in recording order, since its state carries
+from one frame to the next. The results of each recording are written as columns (one entry per
+frame) to <output>/<recording>.npz, readable with numpy.load.
+
+Requires onnxruntime (not needed by the backend itself).
+"""
+import argparse
+import io
+import os
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from autotune import TrackingProfile, profile_path
+from avi import AviMjpegReader, AviReaderCache
+from config import UnitConfig, load_units
+from cv_process.ipc import BoundingBox
+from gimbal import EmulatedGimbal
+from pose_history import PoseHistory
+from recordings import RECORDINGS_DIR, list_recordings, recording_path
+from tracking import Tracking, ReacquisitionConfig
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "model.pt.onnx")
+OUTPUT_DIR = os.path.join(RECORDINGS_DIR, "reprocessed")
+# same as the cv process: detections below this confidence aren't sent to the tracker
+MIN_CONFIDENCE = 0.4
+# the network input of convert_model.sh (height, width), used if the model has dynamic axes
+DEFAULT_INPUT_SIZE = (540, 960)
+
+STATES = ("idle", "tracking", "coasting", "searching")
+
+class OnnxDetector:
+    """
+    CPU version of the nvinfer step of the cv process, with the same pre-processing
+    (pgie_config.txt: RGB, scaled to 0..1, letterboxed with symmetric padding) on the ONNX export of
+    the model. Returns the most confident box, normalized to the camera frame like the cv process.
+
+    Raises:
+      RuntimeError if onnxruntime isn't installed.
+    """
+
+    def __init__(self, model_path: str, threads: int = 1):
+        if onnxruntime is None:
+            raise RuntimeError("onnxruntime is not installed")
+        options = onnxruntime.SessionOptions()
+        # one worker per core, parallelism comes from the process pool
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self._session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        model_input = self._session.get_inputs()[0]
+        self._input_name = model_input.name
+        height, width = model_input.shape[2:4]
+        if not isinstance(height, int) or not isinstance(width, int):
+            height, width = DEFAULT_INPUT_SIZE
+        self._input_size = (width, height)
+
+    def _letterbox(self, img: Image.Image) -> tuple[np.ndarray, float, float, float]:
+        input_w, input_h = self._input_size
+        scale = min(input_w / img.width, input_h / img.height)
+        w, h = round(img.width * scale), round(img.height * scale)
+        pad_x, pad_y = (input_w - w) / 2, (input_h - h) / 2
+
+        canvas = np.zeros((input_h, input_w, 3), dtype=np.float32)
+        x0, y0 = int(pad_x), int(pad_y)
+        canvas[y0:y0 + h, x0:x0 + w] = np.asarray(img.resize((w, h), Image.BILINEAR), dtype=np.float32)
+        tensor = (canvas / 255.0).transpose(2, 0, 1)[np.newaxis]
+        return np.ascontiguousarray(tensor), scale, x0, y0
+
+    def detect(self, jpeg: bytes, pts_s: float) -> Optional[BoundingBox]:
+        img = Image.open(io.BytesIO(jpeg))
+        # let libjpeg decode at (close to) the network resolution instead of full size
+        img.draft("RGB", self._input_size)
+        img = img.convert("RGB")
+        tensor, scale, pad_x, pad_y = self._letterbox(img)
+
+        # DeepStream-Yolo export: (batch, boxes, [x1, y1, x2, y2, score, class]) in network pixels
+        output = self._session.run(None, {self._input_name: tensor})[0][0]
+        if len(output) == 0:
+            return None
+        best = output[np.argmax(output[:, 4])]
+        if best[4] <= MIN_CONFIDENCE:
+            return None
+
+        # back to (decoded) image pixels, then normalized, which doesn't depend on the draft scale
+        x1, x2 = (best[[0, 2]] - pad_x) / scale / img.width
+        y1, y2 = (best[[1, 3]] - pad_y) / scale / img.height
+        x1, x2 = np.clip([x1, x2], 0.0, 1.0)
+        y1, y2 = np.clip([y1, y2], 0.0, 1.0)
+        return BoundingBox(pts_s=pts_s, conf=float(best[4]), left=float(x1), top=float(y1),
+                           width=float(x2 - x1), height=float(y2 - y1), capture_time_s=pts_s)
+
+# ── Process pool ───────────────────────────────────────────────────────────────
+_detector: Optional[OnnxDetector] = None
+# indexing walks the whole file, so each worker does it once per recording rather than per chunk
+_readers: Optional[AviReaderCache] = None
+
+def _init_worker(model_path: str):
+    global _detector, _readers
+    _detector = OnnxDetector(model_path)
+    _readers = AviReaderCache()
+
+def _detect_chunk(path: str, start: int, end: int) -> tuple[int, np.ndarray, float]:
+    """Detections of frames [start, end) as rows of (conf, left, top, width, height), NaN if none."""
+    rows = np.full((end - start, 5), np.nan)
+    cpu_start = time.process_time()
+    reader = _readers.get(path)
+    for i in range(start, end):
+        bbox = _detector.detect(reader.frame(i), i / reader.fps)
+        if bbox:
+            rows[i - start] = (bbox.conf, bbox.left, bbox.top, bbox.width, bbox.height)
+    return start, rows, time.process_time() - cpu_start
+
+# ── Tracker replay ─────────────────────────────────────────────────────────────
+class _ReplayTrajectory:
+    """Stands in for the trajectory generator: remembers the last target the tracker commanded."""
+
+    def __init__(self):
+        self._target = (0.0, 0.0)
+
+    def move_to(self, tilt: float, pan: float):
+        self._target = (tilt, pan)
+
+    def target(self):
+        return self._target
+
+def _unit_config(unit: str) -> UnitConfig:
+    for config in load_units():
+        if config.name == unit:
+            return config
+    return UnitConfig(name=unit)
+
+def replay_tracking(detections: np.ndarray, fps: float, config: UnitConfig, k_p: Optional[float] = None,
+                    reacquisition: Optional[ReacquisitionConfig] = None) -> dict[str, np.ndarray]:
+    """
+    Run the tracker over the per-frame detections of a recording, frame by frame on the recording's
+    clock. The gimbal angles at recording time weren't recorded, so the camera is taken as fixed:
+    errors are relative to the image center, and the commanded angles are what the tracker would
+    have asked for from there.
+    """
+    trajectory = _ReplayTrajectory()
+    history = PoseHistory()
+    # the camera is mounted rotated by 90 degrees
+    width, height = config.height, config.width
+    tracking = Tracking(EmulatedGimbal(), trajectory, history, width=width, height=height,
+                        k_p=k_p if k_p is not None else 0.003, deg_per_px=config.hfov_deg / config.width,
+                        reacquisition=reacquisition or ReacquisitionConfig(loss_timeout_s=config.loss_timeout_s),
+                        threaded=False)
+    if k_p is None and os.path.isfile(profile_path(config.name)):
+        tracking.apply_profile(TrackingProfile.load(profile_path(config.name)))
+    tracking.set_active(True)
+
+    n = len(detections)
+    columns = {name: np.full(n, np.nan) for name in
+               ("error_x_px", "error_y_px", "error_tilt_deg", "error_pan_deg", "cmd_tilt_deg", "cmd_pan_deg")}
+    columns["state"] = np.zeros(n, dtype=np.int8)
+
+    deg_per_px = config.hfov_deg / config.width
+    for i, (conf, left, top, w, h) in enumerate(detections):
+        t = i / fps
+        history.record_measured(t, 0.0, 0.0)
+        bbox = None
+        if not np.isnan(conf):
+            # rotate 90 degrees, as the backend does with the detections of the cv process
+            bbox = BoundingBox(pts_s=t, conf=conf, left=1 - (top + h), top=left, width=h, height=w,
+                               capture_time_s=t)
+            cx, cy = bbox.center()
+            columns["error_x_px"][i] = cx * width - width / 2
+            columns["error_y_px"][i] = cy * height - height / 2
+            columns["error_pan_deg"][i] = columns["error_x_px"][i] * deg_per_px
+            columns["error_tilt_deg"][i] = -columns["error_y_px"][i] * deg_per_px
+
+        tracking.step(bbox, t)
+        columns["state"][i] = STATES.index(tracking.metrics()["state"])
+        columns["cmd_tilt_deg"][i], columns["cmd_pan_deg"][i] = trajectory.target()
+
+    tracking.stop()
+    return columns
+
+# ── Driver ─────────────────────────────────────────────────────────────────────
+def reprocess(names: list[str], model_path: str = DEFAULT_MODEL, workers: Optional[int] = None,
+              chunk_frames: int = 256, output_dir: str = OUTPUT_DIR, k_p: Optional[float] = None) -> dict:
+    """
+    Reprocess recordings (by file name) and write <output_dir>/<name>.npz for each.
+    Returns the throughput: frames, wall time, frames per second overall and per core.
+    """
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+
+    # frame counts first, so all chunks of all recordings can be queued at once
+    recordings = []
+    for name in names:
+        path = recording_path(name)
+        with AviMjpegReader(path) as reader:
+            recordings.append((name, path, reader.frame_count, reader.fps))
+
+    total_frames = sum(count for _, _, count, _ in recordings)
+    cpu_s = 0.0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_path,)) as pool:
+        futures = {
+            name: [pool.submit(_detect_chunk, path, i, min(i + chunk_frames, count))
+                   for i in range(0, count, chunk_frames)]
+            for name, path, count, _ in recordings
+        }
+        for name, path, count, fps in recordings:
+            detections = np.full((count, 5), np.nan)
+            for future in futures[name]:
+                chunk_start, rows, chunk_cpu_s = future.result()
+                detections[chunk_start:chunk_start + len(rows)] = rows
+                cpu_s += chunk_cpu_s
+
+            unit = name[:-len(".avi")].rpartition("_")[0]
+            tracking = replay_tracking(detections, fps, _unit_config(unit), k_p=k_p)
+            np.savez_compressed(
+                os.path.join(output_dir, name[:-len(".avi")] + ".npz"),
+                frame=np.arange(count), t_s=np.arange(count) / fps,
+                conf=detections[:, 0], left=detections[:, 1], top=detections[:, 2],
+                width=detections[:, 3], height=detections[:, 4],
+                states=np.array(STATES), **tracking,
+            )
+            logger.info(f"{name}: {count} frames, {np.count_nonzero(~np.isnan(detections[:, 0]))} detections")
+
+    wall_s = time.perf_counter() - start
+    return {
+        "frames": total_frames,
+        "workers": workers,
+        "wall_s": wall_s,
+        "fps": total_frames / wall_s if wall_s > 0 else 0.0,
+        "fps_per_core": total_frames / wall_s / workers if wall_s > 0 else 0.0,
+        # independent of how busy the machine was: frames per second of worker CPU time
+        "fps_per_cpu_s": total_frames / cpu_s if cpu_s > 0 else 0.0,
+    }
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Rerun detection and tracking over recordings")
+    parser.add_argument("recordings", nargs="*", help="recording file names (default: all finished recordings)")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="ONNX model")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--chunk", type=int, default=256, help="frames per work item")
+    parser.add_argument("--output", default=OUTPUT_DIR, help="output directory")
+    parser.add_argument("--k-p", type=float, default=None, help="tracker gain (default: the unit's profile)")
+    args = parser.parse_args()
+
+    names = args.recordings or [r["name"] for r in list_recordings() if not r["active"]]
+    result = reprocess(names, model_path=args.model, workers=args.workers, chunk_frames=args.chunk,
+                       output_dir=args.output, k_p=args.k_p)
+    print(f"{result['frames']} frames in {result['wall_s']:.1f} s with {result['workers']} workers: "
+          f"{result['fps']:.1f} fps, {result['fps_per_core']:.1f} fps per core "
+          f"({result['fps_per_cpu_s']:.1f} fps per CPU second)")
@@ -0,0 +1,106 @@
+import threading
+import time
+import logging
+from typing import Callable, Tuple
+
+from cv_process.ipc import BoundingBox
+from gimbal import EmulatedGimbal
+from pose_history import PoseHistory
+from trajectory import TrajectoryGenerator
+from tracking import Tracking, ReacquisitionConfig
+
+logger = logging.getLogger(__name__)
+
+class SimulatedDetector:
+    """
+    Stands in for the camera + cv process: renders a target moving along target(t) (tilt, pan in
+    degrees) into detections, based on where the emulated gimbal was pointing at capture time.
+
+    No detections are produced while visible(t) is False (occlusion, detector misses) or while
+    the target is outside the field of view.
+    """
+
+    def __init__(self, gimbal: EmulatedGimbal, tracking: Tracking, width: int, height: int, deg_per_px: float,
+                 target: Callable[[float], Tuple[float, float]], visible: Callable[[float], bool] = lambda t: True,
+                 fps: float = 60.0, latency_s: float = 0.05):
+        self._gimbal = gimbal
+        self._tracking = tracking
+        self._width = width
+        self._height = height
+        self._deg_per_px = deg_per_px
+        self._target = target
+        self._visible = visible
+        self._fps = fps
+        self._latency_s = latency_s
+        self._stop_event = threading.Event()
+        self._start = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="simulated-detector", daemon=True)
+        self._thread.start()
+
+    def _detect(self, t: float, capture_time: float, pose: Tuple[float, float]):
+        if not self._visible(t):
+            return None
+        target_tilt, target_pan = self._target(t)
+        cx = 0.5 + (target_pan - pose[1]) / (self._deg_per_px * self._width)
+        cy = 0.5 - (target_tilt - pose[0]) / (self._deg_per_px * self._height)
+        if not (0.0 < cx < 1.0 and 0.0 < cy < 1.0):
+            return None
+        size = 0.02
+        return BoundingBox(pts_s=t, conf=0.9, left=cx - size / 2, top=cy - size / 2, width=size, height=size,
+                           capture_time_s=capture_time)
+
+    def _run(self):
+        # frames waiting for the detector latency to pass: (ready time, bbox)
+        in_flight = []
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            bbox = self._detect(now - self._start, now, self._gimbal.measure_deg())
+            if bbox:
+                in_flight.append((now + self._latency_s, bbox))
+            while in_flight and in_flight[0][0] <= now:
+                self._tracking.on_detection(in_flight.pop(0)[1])
+            time.sleep(1.0 / self._fps)
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+def run_reacquisition_scenario(duration_s: float = 20.0, occlusions=((4.0, 5.0), (9.0, 10.5), (14.0, 16.0)),
+                               speed_dps: float = 4.0, turn_at_s: float = 14.5) -> dict:
+    """
+    A climbing target that is repeatedly hidden (e.g. behind smoke or clouds), tracked by an
+    emulated unit. At turn_at_s, while hidden, the target changes direction so coasting alone
+    doesn't find it and the search has to.
+
+    Returns the tracker metrics, including the time to reacquire after each loss.
+    """
+    width, height, deg_per_px = 1080, 1920, 60.0 / 1920
+
+    gimbal = EmulatedGimbal(slew_rate_dps=200.0, tilt=10.0, pan=-20.0)
+    history = PoseHistory()
+    trajectory = TrajectoryGenerator(gimbal, pose_history=history)
+    tracking = Tracking(gimbal, trajectory, history, width=width, height=height, k_p=deg_per_px * 0.5,
+                        deg_per_px=deg_per_px, reacquisition=ReacquisitionConfig())
+    tracking.set_active(True)
+
+    def target(t: float):
+        tilt, pan = 10.0 + speed_dps * t, -20.0 + 0.5 * speed_dps * t
+        if t > turn_at_s:
+            # drift back the other way, twice as fast
+            pan -= 1.5 * speed_dps * (t - turn_at_s)
+        return tilt, pan
+
+    def visible(t: float):
+        return not any(start <= t < end for start, end in occlusions)
+
+    detector = SimulatedDetector(gimbal, tracking, width, height, deg_per_px, target, visible)
+    time.sleep(duration_s)
+    detector.stop()
+    tracking.stop()
+    trajectory.stop()
+
+    return tracking.metrics()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(run_reacquisition_scenario())
@@ -0,0 +1,96 @@
+import dataclasses
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from cv_process.ipc import BoundingBox
+
+# detections kept for matching against the (delayed) preview frames
+MAX_BBOXES = 10
+
+@dataclass(frozen=True)
+class ReceivedBoundingBox:
+    bbox: BoundingBox
+    received_time: float
+
+@dataclass(frozen=True)
+class StateSnapshot:
+    """
+    Everything status() reports about a unit, as of one point in time. Never mutated: writers
+    publish a new snapshot instead, so a reader always sees a consistent set of values.
+    """
+    seq: int = 0
+    armed: bool = False
+    # most recent last, at most MAX_BBOXES
+    bboxes: Tuple[ReceivedBoundingBox, ...] = ()
+    angles: Optional[Tuple[float, float]] = None
+    # time.monotonic() of the measurement
+    angles_time: Optional[float] = None
+    # base64 encoded JPEG, encoded once when the frame arrives rather than on every request
+    frame: Optional[str] = None
+    # time.time() at which the frame was received
+    frame_time: Optional[float] = None
+    frame_seq: int = 0
+
+    def bbox_at(self, timestamp: float | None) -> BoundingBox | None:
+        """The most recent detection received at or shortly before timestamp (time.time())."""
+        if not self.bboxes:
+            return None
+        if timestamp is None:
+            return self.bboxes[-1].bbox
+        for received in reversed(self.bboxes):
+            if received.received_time <= timestamp:
+                if timestamp - received.received_time >= 1 / 30:
+                    return None
+                return received.bbox
+        return None
+
+    def angles_if_fresh(self, max_age_s: float, now: float) -> Optional[Tuple[float, float]]:
+        if self.angles_time is None or now - self.angles_time > max_age_s:
+            return None
+        return self.angles
+
+class SnapshotPublisher:
+    """
+    Holds the current StateSnapshot of a unit.
+
+    Readers (request threads) take `current` without any lock: it is a single reference, and
+    rebinding it is atomic. Writers (IPC, preview, trajectory threads, arm/disarm) build the next
+    snapshot from the current one and swap it in; they serialize among themselves so that
+    concurrent updates of different fields aren't lost, but never block readers.
+    """
+
+    def __init__(self):
+        self._write_lock = threading.Lock()
+        self.current = StateSnapshot()
+
+    def publish(self, **changes) -> StateSnapshot:
+        with self._write_lock:
+            snapshot = dataclasses.replace(self.current, seq=self.current.seq + 1, **changes)
+            self.current = snapshot
+        return snapshot
+
+    def set_armed(self, armed: bool):
+        self.publish(armed=armed)
+
+    def set_angles(self, t: float, tilt: float, pan: float):
+        self.publish(angles=(tilt, pan), angles_time=t)
+
+    def add_bbox(self, bbox: BoundingBox):
+        now = time.time()
+        with self._write_lock:
+            bboxes = self.current.bboxes
+            if bboxes and bboxes[-1].bbox.pts_s == bbox.pts_s:
+                # several detections in the same frame, keep the most confident one
+                if bbox.conf <= bboxes[-1].bbox.conf:
+                    return
+                bboxes = bboxes[:-1] + (ReceivedBoundingBox(bbox, bboxes[-1].received_time),)
+            else:
+                bboxes = (bboxes + (ReceivedBoundingBox(bbox, now),))[-MAX_BBOXES:]
+            self.current = dataclasses.replace(self.current, seq=self.current.seq + 1, bboxes=bboxes)
+
+    def set_frame(self, frame: str, frame_time: float):
+        with self._write_lock:
+            self.current = dataclasses.replace(self.current, seq=self.current.seq + 1, frame=frame,
+                                               frame_time=frame_time, frame_seq=self.current.frame_seq + 1)
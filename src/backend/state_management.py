@@ -1,106 +1,221 @@
 import logging
+import threading
 
+from autotune import AutoTuner, profile_path
+from config import UnitConfig, load_units
 from cv import CVPipeline
 from cv_process.ipc import BoundingBox
-from gimbal import GimbalSerial
-from preview import MjpegFrameReceiver
+from cv_process.preview_ring import ring_path
+from errors import InvalidRequest, NotFound
+from gimbal import create_gimbal
+from h264_preview import Fmp4PreviewRelay
+from preview import MjpegFrameReceiver, ShmFrameReceiver
 import base64
 import time
-from dataclasses import dataclass
+from dataclasses import asdict
 
-from tracking import Tracking
+from pose_history import PoseHistory
+from profiler import register_queue
+from recordings import DetectionEventLog
+from snapshot import SnapshotPublisher
+from tracking import Tracking, ReacquisitionConfig
+from trajectory import TrajectoryGenerator
 
 logger = logging.getLogger(__name__)
 
-@dataclass
-class InternalBoundingBox:
-    bbox: BoundingBox
-    received_time: float
+class Unit:
+    """
+    State of one camera + gimbal pair.
+    """
+
+    def __init__(self, config: UnitConfig):
+        self.config = config
+
+        # what status() reports, published by the threads that produce it
+        self.snapshots = SnapshotPublisher()
+
+        self.gimbal = create_gimbal(config.gimbal_port, baudrate=115200, timeout=0.1)
+        self.pose_history = PoseHistory(on_measured=self.snapshots.set_angles)
+        # all motion goes through the trajectory generator so the camera doesn't shake
+        self.trajectory = TrajectoryGenerator(self.gimbal, pose_history=self.pose_history,
+                                              name=f"trajectory-{config.name}")
+        self.trajectory.move_to(0, 0)
+        # the camera is mounted rotated by 90 degrees
+        self.tracking = Tracking(gimbal=self.gimbal, trajectory=self.trajectory, pose_history=self.pose_history,
+                                 width=config.height, height=config.width, k_p=0.003,
+                                 profile_path=profile_path(config.name), name=f"tracking-{config.name}",
+                                 deg_per_px=config.hfov_deg / config.width,
+                                 reacquisition=ReacquisitionConfig(loss_timeout_s=config.loss_timeout_s))
+
+        # the TCP receiver stays up as the fallback when the cv process can't use the shared memory ring
+        self.preview_receiver = MjpegFrameReceiver(port=config.preview_port, on_frame=self._on_preview_frame)
+        self.shm_preview_receiver = None
+        if config.preview_transport == "shm":
+            self.shm_preview_receiver = ShmFrameReceiver(
+                ring_path(config.name), on_frame=self.snapshots.set_frame,
+                transform=lambda jpeg: base64.b64encode(jpeg).decode("ascii"))
+        self.h264_relay = Fmp4PreviewRelay(port=config.h264_port) if config.h264_preview else None
+        # triggered clips get their events from the cv process, which knows where each clip starts
+        self.detection_events = DetectionEventLog(config.name) if config.recording_mode == "continuous" else None
+        self.autotune_thread: threading.Thread | None = None
+        self.autotune_stop = threading.Event()
+        self.autotune_status = {"running": False, "error": None, "profile": None}
+
+        register_queue(f"tracking-{config.name}", self.tracking.queue_depth)
+
+    def _on_preview_frame(self, jpeg: bytes, recv_time: float):
+        self.snapshots.set_frame(base64.b64encode(jpeg).decode("ascii"), recv_time)
+
+class UnknownUnit(NotFound):
+    """A unit name that isn't in the unit config."""
 
-class BoundingBoxCollection:
-    _internal_bboxes: list[InternalBoundingBox]
-
-    def __init__(self):
-        self._internal_bboxes = []
-
-    def received_bbox(self, bbox: BoundingBox):
-        now = time.time()
-
-        if self._internal_bboxes:
-            last_bbox = self._internal_bboxes[-1].bbox
-            if bbox.pts_s == last_bbox.pts_s:
-                if bbox.conf > last_bbox.conf:
-                    self._internal_bboxes[-1].bbox = bbox
-            else:
-                self._internal_bboxes.append(InternalBoundingBox(bbox=bbox, received_time=now))
-        else:
-            self._internal_bboxes.append(InternalBoundingBox(bbox=bbox, received_time=now))
-
-        if len(self._internal_bboxes) > 10:
-            self._internal_bboxes.pop(0)
-
-    def get_bbox(self, timestamp: float | None) -> BoundingBox | None:
-        if not self._internal_bboxes:
-            return None
-
-        if timestamp is None:
-            return self._internal_bboxes[-1].bbox
+class StateManagement:
+    def __init__(self, units: list[UnitConfig] | None = None):
+        # written by request threads, read by the IPC threads; a single reference, never mutated
+        self._armed = False
 
-        # Find the most recent bbox with received_time <= timestamp
-        for internal_bbox in reversed(self._internal_bboxes):
-            if internal_bbox.received_time <= timestamp:
-                if timestamp - internal_bbox.received_time >= 1/30:
-                    return None
-                return internal_bbox.bbox
+        if units is None:
+            units = load_units()
+        self._units = {config.name: Unit(config) for config in units}
+        self._default_unit = units[0].name
 
-        return None
+        self._cv_pipeline = CVPipeline(units, lambda name, v: self._on_detection(name, v))
 
-class StateManagement:
-    def __init__(self):
-        self._armed = False
+    def _unit(self, name: str | None) -> Unit:
+        if name is None:
+            name = self._default_unit
+        unit = self._units.get(name)
+        if unit is None:
+            raise UnknownUnit(f"Unknown unit: {name}")
+        return unit
 
-        self._gimbal = GimbalSerial(port="/dev/ttyTHS1", baudrate=115200, timeout=0.1)
-        self._gimbal.move_deg(0,0)
-        self._tracking = Tracking(gimbal=self._gimbal, width=1080, height=1920, k_p=0.003)
+    @property
+    def cv_pid(self) -> int:
+        return self._cv_pipeline.pid
 
-        self._preview_receiver = MjpegFrameReceiver()
-        self._cv_pipeline = CVPipeline(lambda v: self._on_detection(v))
-        self._bboxes = BoundingBoxCollection()
+    def units(self):
+        return [unit.config.to_dict() for unit in self._units.values()]
 
-    def _on_detection(self, bbox: BoundingBox):
-        self._bboxes.received_bbox(bbox)
+    def _on_detection(self, unit_name: str, bbox: BoundingBox):
+        unit = self._units[unit_name]
+        unit.snapshots.add_bbox(bbox)
+        if unit.detection_events:
+            unit.detection_events.on_detection(bbox.pts_s)
 
         if self._armed:
-            self._tracking.on_detection(bbox.center())
+            unit.tracking.on_detection(bbox)
+
+    def autotune(self, unit_name: str | None = None) -> bool:
+        """
+        Start an auto-tune session on a unit in the background. The fitted profile is saved and
+        applied to the unit's tracker when the session finishes.
+        Returns False if the system is armed or a session is already running. Arming cancels
+        a running session.
+        """
+        if self._armed:
+            return False
+        unit = self._unit(unit_name)
+        if unit.autotune_thread and unit.autotune_thread.is_alive():
+            return False
+
+        unit.autotune_stop.clear()
+
+        def run():
+            unit.autotune_status = {"running": True, "error": None, "profile": None}
+            try:
+                tuner = AutoTuner(unit.gimbal, width=unit.config.height, height=unit.config.width,
+                                  hfov_deg=unit.config.hfov_deg)
+                # the excitation has to reach the gimbal unfiltered
+                with unit.trajectory.suspended():
+                    profile = tuner.run(stop_event=unit.autotune_stop)
+                # once armed, the tracker owns the gimbal
+                if not self._armed:
+                    unit.trajectory.move_to(0, 0)
+                profile.save(profile_path(unit.config.name))
+                unit.tracking.apply_profile(profile)
+                unit.autotune_status = {"running": False, "error": None, "profile": asdict(profile)}
+            except Exception as e:
+                logger.error(f"Auto-tune failed: {e}")
+                unit.autotune_status = {"running": False, "error": str(e), "profile": None}
+
+        unit.autotune_thread = threading.Thread(target=run, name=f"autotune-{unit.config.name}", daemon=True)
+        unit.autotune_thread.start()
+        return True
+
+    def autotune_status(self, unit_name: str | None = None):
+        return self._unit(unit_name).autotune_status
+
+    def cancel_autotune(self, unit_name: str | None = None) -> bool:
+        """Stop a running auto-tune session. Returns False if none was running."""
+        unit = self._unit(unit_name)
+        if not (unit.autotune_thread and unit.autotune_thread.is_alive()):
+            return False
+        unit.autotune_stop.set()
+        return True
 
     def arm(self):
         self._armed = True
-        # self._cv_pipeline.armed = True
+        for unit in self._units.values():
+            unit.autotune_stop.set()
+        for unit in self._units.values():
+            # the excitation stops within a sample, then the trajectory generator streams again
+            if unit.autotune_thread:
+                unit.autotune_thread.join(timeout=1.0)
+        for unit in self._units.values():
+            unit.snapshots.set_armed(True)
+            unit.tracking.set_active(True)
+        self._cv_pipeline.set_armed(True)
 
     def disarm(self):
         self._armed = False
-        # self._cv_pipeline.armed = False
+        for unit in self._units.values():
+            unit.snapshots.set_armed(False)
+            unit.tracking.set_active(False)
+        self._cv_pipeline.set_armed(False)
+
+    def status(self, unit_name: str | None = None):
+        """
+        Served from the unit's current snapshot: no locks, no serial round trip and no encoding,
+        and all the values belong together.
+        """
+        unit = self._unit(unit_name)
+        snapshot = unit.snapshots.current
 
-    def status(self):
-        latest_preview_frame, latest_preview_frame_time = self._preview_receiver.get_latest_frame()
         bbox = None
-        if latest_preview_frame is not None:
-            latest_preview_frame = base64.b64encode(latest_preview_frame).decode("ascii")
+        if snapshot.frame is not None:
             # preview is delayed by 3 frames
-            bbox = self._bboxes.get_bbox(latest_preview_frame_time - 3 / 60)
-
-        try:
-            tilt, pan = self._gimbal.measure_deg()
-            return {"armed": self._armed, "tilt": tilt, "pan": pan, "preview": latest_preview_frame, "bbox": bbox}
-        except Exception as e:
-            logger.error(f"Error reading status: {e}")
-            return {"armed": self._armed, "tilt": None, "pan": None, "preview": latest_preview_frame, "bbox": bbox}
-
-    def manual_move(self, direction: str):
+            bbox = snapshot.bbox_at(snapshot.frame_time - 3 / 60)
+
+        # the trajectory generator samples the angles continuously
+        angles = snapshot.angles_if_fresh(max_age_s=0.1, now=time.monotonic())
+        tilt, pan = angles if angles is not None else (None, None)
+        return {"unit": unit.config.name, "armed": snapshot.armed, "tilt": tilt, "pan": pan,
+                "preview": snapshot.frame, "frame_seq": snapshot.frame_seq, "bbox": bbox,
+                "tracking": unit.tracking.metrics()}
+
+    def h264_preview_info(self, unit_name: str | None = None):
+        relay = self._unit(unit_name).h264_relay
+        if relay is None:
+            return {"enabled": False, "codec": None, "viewers": 0}
+        return {"enabled": True, "codec": relay.codec, "viewers": relay.viewer_count()}
+
+    def h264_preview_stream(self, unit_name: str | None = None):
+        """
+        Raises:
+          InvalidRequest if the unit has no H.264 preview or it isn't streaming yet.
+        """
+        relay = self._unit(unit_name).h264_relay
+        if relay is None:
+            raise InvalidRequest(f"The H.264 preview isn't enabled for unit {unit_name}")
+        return relay.stream()
+
+    def manual_move(self, direction: str, unit_name: str | None = None):
         if self._armed:
             return
+        unit = self._unit(unit_name)
         try:
-            current_tilt, current_pan = self._gimbal.measure_deg()
+            # relative to the target so that repeated clicks accumulate during the motion
+            current_tilt, current_pan = unit.trajectory.target()
             delta = 10.0  # degrees per command
 
             if direction == "up":
@@ -119,16 +234,17 @@ class StateManagement:
                 logger.warning(f"Unknown direction: {direction}")
                 return
 
-            self._gimbal.move_deg(new_tilt, new_pan)
+            unit.trajectory.move_to(new_tilt, new_pan)
         except Exception as e:
             logger.error(f"Error in manual_move: {e}")
 
-    def manual_move_to(self, tilt: float, pan: float):
+    def manual_move_to(self, tilt: float, pan: float, unit_name: str | None = None):
         if self._armed:
             return
+        unit = self._unit(unit_name)
         try:
             new_tilt = max(0.0, min(90.0, tilt))
             new_pan = max(-45.0, min(45.0, pan))
-            self._gimbal.move_deg(new_tilt, new_pan)
+            unit.trajectory.move_to(new_tilt, new_pan)
         except Exception as e:
             logger.error(f"Error in manual_move_to: {e}")
@@ -0,0 +1,196 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from PIL import Image
+
+from avi import AviReaderCache
+from errors import InvalidRequest
+from recordings import RECORDINGS_DIR, recording_path, read_events
+
+logger = logging.getLogger(__name__)
+
+THUMBNAILS_DIR = os.path.join(RECORDINGS_DIR, "thumbnails")
+# thumbnail widths accepted from requests, in pixels
+MIN_WIDTH = 16
+MAX_WIDTH = 640
+
+class DiskLruCache:
+    """
+    Size-bounded cache of small files. Recency is tracked with the file mtime, so the LRU order
+    survives restarts; the least recently used files are deleted when max_bytes is exceeded.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # file name -> size, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        existing = sorted(os.scandir(directory), key=lambda e: e.stat().st_mtime)
+        for entry in existing:
+            if entry.name.endswith(".tmp"):
+                # left over from a put() that didn't finish
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+            elif entry.is_file():
+                self._entries[entry.name] = entry.stat().st_size
+                self._total_bytes += entry.stat().st_size
+
+    @staticmethod
+    def _file_name(key: str) -> str:
+        return hashlib.sha1(key.encode()).hexdigest() + ".jpg"
+
+    def get(self, key: str) -> Optional[bytes]:
+        name = self._file_name(key)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        path = os.path.join(self._directory, name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            with self._lock:
+                self._total_bytes -= self._entries.pop(name, 0)
+            return None
+
+    def put(self, key: str, data: bytes):
+        name = self._file_name(key)
+        path = os.path.join(self._directory, name)
+        # a temporary file per call, concurrent puts of the same key each replace the file whole
+        with tempfile.NamedTemporaryFile(dir=self._directory, suffix=".tmp", delete=False) as f:
+            f.write(data)
+        try:
+            os.replace(f.name, path)
+        except OSError:
+            os.remove(f.name)
+            raise
+
+        with self._lock:
+            self._total_bytes += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            evicted = []
+            while self._total_bytes > self._max_bytes and len(self._entries) > 1:
+                old_name, old_size = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(old_name)
+
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self._directory, old_name))
+            except OSError:
+                pass
+
+class ThumbnailService:
+    """
+    Reduced-size thumbnails and sprite strips of recordings, for scrubbing.
+
+    Thumbnails are generated lazily on first request. The JPEG frames are decoded at reduced size
+    (PIL draft mode lets libjpeg scale by 1/2, 1/4 or 1/8 during the DCT), which is much cheaper
+    than decoding the full 1080p frame. Results are kept in a size-bounded on-disk LRU cache keyed
+    by recording, time and size, and the most recently requested strips are also kept in memory.
+    """
+
+    def __init__(self, cache_bytes: int = 256 * 1024 * 1024, memory_strips: int = 32, quality: int = 70):
+        self._readers = AviReaderCache()
+        self._disk = DiskLruCache(THUMBNAILS_DIR, cache_bytes)
+        self._memory_strips = memory_strips
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._quality = quality
+
+    def _decode(self, jpeg: bytes, width: int) -> Image.Image:
+        img = Image.open(io.BytesIO(jpeg))
+        img.draft("RGB", (width, width * img.height // img.width))
+        img = img.convert("RGB")
+        img.thumbnail((width, width * img.height // img.width))
+        return img
+
+    def _encode(self, img: Image.Image) -> bytes:
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=self._quality)
+        return out.getvalue()
+
+    def etag(self, recording: str, *key) -> str:
+        """
+        ETag of a thumbnail or strip, known without generating it: the output only depends on
+        the request and the recording file, which only changes while it is being recorded.
+        """
+        path = recording_path(recording)
+        return hashlib.sha1(repr((recording, os.path.getmtime(path)) + key).encode()).hexdigest()[:20]
+
+    @staticmethod
+    def _check_width(width: int):
+        if not MIN_WIDTH <= width <= MAX_WIDTH:
+            raise InvalidRequest(f"Thumbnail width must be between {MIN_WIDTH} and {MAX_WIDTH}")
+
+    def thumbnail(self, recording: str, t_s: float, width: int = 160) -> bytes:
+        self._check_width(width)
+        reader = self._readers.get(recording_path(recording))
+        index = reader.frame_index(t_s)
+        key = f"thumb:{recording}:{index}:{width}"
+
+        data = self._disk.get(key)
+        if data is None:
+            data = self._encode(self._decode(reader.frame(index), width))
+            self._disk.put(key, data)
+        return data
+
+    def strip_times(self, recording: str, mode: str, start_s: float, interval_s: float, count: int) -> list[float]:
+        """Times of the tiles of a strip: every interval_s from start_s, or the detection events."""
+        if mode == "events":
+            events = [t for t in read_events(recording_path(recording)) if t >= start_s]
+            return events[:count]
+        if mode == "interval":
+            return [start_s + i * interval_s for i in range(count)]
+        raise InvalidRequest(f"Unknown strip mode: {mode}")
+
+    def strip(self, recording: str, mode: str = "interval", start_s: float = 0.0, interval_s: float = 10.0,
+              count: int = 10, width: int = 160) -> bytes:
+        """A horizontal sprite of count thumbnails, each width pixels wide."""
+        if count <= 0 or count > 100 or interval_s <= 0:
+            raise InvalidRequest("Invalid strip parameters")
+        self._check_width(width)
+
+        # keyed by the ETag, so strips of a recording that is still growing are regenerated
+        key = "strip:" + self.etag(recording, "strip", mode, start_s, interval_s, count, width)
+        with self._memory_lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+
+        data = self._disk.get(key)
+        if data is None:
+            reader = self._readers.get(recording_path(recording))
+            tiles = [Image.open(io.BytesIO(self.thumbnail(recording, t, width)))
+                     for t in self.strip_times(recording, mode, start_s, interval_s, count)
+                     if t < reader.duration_s]
+            if not tiles:
+                raise InvalidRequest("No frames in the requested range")
+
+            sprite = Image.new("RGB", (width * len(tiles), max(tile.height for tile in tiles)))
+            for i, tile in enumerate(tiles):
+                sprite.paste(tile, (i * width, 0))
+            data = self._encode(sprite)
+            self._disk.put(key, data)
+
+        with self._memory_lock:
+            self._memory[key] = data
+            while len(self._memory) > self._memory_strips:
+                self._memory.popitem(last=False)
+        return data
@@ -1,30 +1,137 @@
 from typing import Tuple, Optional
+from collections import deque
+from dataclasses import dataclass
+import math
 import threading
 import time
 import queue
 import logging
+import os
 from gimbal import GimbalSerial
+from autotune import TrackingProfile
+from cv_process.ipc import BoundingBox
+from pose_history import PoseHistory
+from trajectory import TrajectoryGenerator
 
 logger = logging.getLogger(__name__)
 
+TILT_RANGE = (0.0, 90.0)
+PAN_RANGE = (-45.0, 45.0)
+
+@dataclass
+class ReacquisitionConfig:
+    """
+    What the tracker does when detections stop:
+    after loss_timeout_s it coasts along the last estimated angular velocity for coast_s, then
+    searches in an expanding spiral around where the target was expected, for at most search_s.
+
+    While coasting or searching, only detections close to where the target is expected are accepted
+    as the same target: within gate_deg plus gate_growth_dps per second lost, at most max_gate_deg,
+    of the predicted bearing, or while searching, of the point of the spiral being searched.
+    """
+    loss_timeout_s: float = 0.3
+    coast_s: float = 1.0
+    max_coast_velocity_dps: float = 90.0
+    search_s: float = 10.0
+    search_speed_dps: float = 40.0
+    search_spacing_deg: float = 15.0
+    gate_deg: float = 5.0
+    gate_growth_dps: float = 30.0
+    max_gate_deg: float = 15.0
+
 class Tracking:
-    def __init__(self, gimbal: GimbalSerial, width: int, height: int, k_p: float):
+    """
+    Closed loop tracking of one unit.
+
+    state is one of:
+      "idle":      not armed, or the target was lost and the search gave up
+      "tracking":  following detections
+      "coasting":  detections stopped, continuing along the last angular velocity
+      "searching": running an expanding spiral search around the predicted bearing
+    """
+
+    def __init__(self, gimbal: GimbalSerial, trajectory: TrajectoryGenerator, pose_history: PoseHistory,
+                 width: int, height: int, k_p: float, deg_per_px: float, profile_path: Optional[str] = None,
+                 name: str = "tracking", reacquisition: Optional[ReacquisitionConfig] = None, threaded: bool = True):
         self._gimbal = gimbal
+        # corrections are re-targets of the trajectory rather than raw setpoints, so they blend into the motion
+        self._trajectory = trajectory
+        # a detection describes the frame at capture time, so its error is relative to the angle back then
+        self._pose_history = pose_history
         self._width = width
         self._height = height
-        self._k_p = k_p
+        self._k_p_tilt = k_p
+        self._k_p_pan = k_p
+        # camera geometry, to estimate the true bearing (k_p only corrects a fraction of the error)
+        self._deg_per_px = deg_per_px
+        self._reacquisition = reacquisition or ReacquisitionConfig()
+
+        self._lock = threading.Lock()
+        self._active = False
+        # (time, tilt, pan) of recent target bearings, for the angular velocity estimate
+        self._bearings: deque[Tuple[float, float, float]] = deque(maxlen=30)
+        self._lost_at = 0.0
+        self._coast_velocity = (0.0, 0.0)
+        self._search_center = (0.0, 0.0)
+        self._search_phase = 0.0
+        self._search_updated_at = 0.0
+        self._losses = 0
+        self._reacquire_times_s: deque[float] = deque(maxlen=100)
+        # rebuilt on every state change, so metrics() can be read without taking the lock
+        self._metrics: dict = {}
+        self._set_state("idle")
+
+        # gains from an auto-tune session take precedence over the hand-picked k_p
+        if profile_path and os.path.isfile(profile_path):
+            try:
+                self.apply_profile(TrackingProfile.load(profile_path))
+                logger.info(f"Loaded tracking profile from {profile_path}")
+            except Exception as e:
+                logger.error(f"Failed to load tracking profile {profile_path}: {e}")
 
         # use a queue of size 1; when full, we will drop the old value
-        self._queue: "queue.Queue[Optional[Tuple[float, float]]]" = queue.Queue(maxsize=1)
+        self._queue: "queue.Queue[Optional[BoundingBox]]" = queue.Queue(maxsize=1)
         self._stop_event = threading.Event()
 
-        self._thread = threading.Thread(target=self._worker, daemon=True)
-        self._thread.start()
+        # without the worker thread, the caller drives step() with its own clock (offline replay)
+        self._thread = None
+        if threaded:
+            self._thread = threading.Thread(target=self._worker, name=name, daemon=True)
+            self._thread.start()
+
+    def apply_profile(self, profile: TrackingProfile):
+        self._k_p_tilt = profile.k_p_tilt
+        self._k_p_pan = profile.k_p_pan
 
-    def on_detection(self, center: Optional[Tuple[float, float]]):
+    def set_active(self, active: bool):
+        """Tracking (and reacquisition) only runs while active, i.e. while the system is armed."""
+        with self._lock:
+            self._active = active
+            self._set_state("idle")
+            self._bearings.clear()
+
+    def _set_state(self, state: str):
+        # called with the lock held (or from __init__)
+        self._state = state
+        times = self._reacquire_times_s
+        self._metrics = {
+            "state": state,
+            "losses": self._losses,
+            "reacquisitions": len(times),
+            "last_reacquire_s": times[-1] if times else None,
+            "mean_reacquire_s": sum(times) / len(times) if times else None,
+        }
+
+    def metrics(self) -> dict:
+        return self._metrics
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def on_detection(self, bbox: Optional[BoundingBox]):
         # try to put; if full, drop the old value and put the new one
         try:
-            self._queue.put_nowait(center)
+            self._queue.put_nowait(bbox)
         except queue.Full:
             try:
                 # drop oldest
@@ -32,42 +139,176 @@ class Tracking:
             except queue.Empty:
                 pass
             try:
-                self._queue.put_nowait(center)
+                self._queue.put_nowait(bbox)
             except queue.Full:
                 # if it still fails, just ignore (rare)
                 pass
 
+    def _capture_pose(self, bbox: BoundingBox) -> Tuple[float, float]:
+        """Gimbal angles when the frame of the detection was captured."""
+        pose = self._pose_history.measured_at(bbox.capture_time_s)
+        if pose is None:
+            pose = self._pose_history.commanded_at(bbox.capture_time_s)
+        if pose is None:
+            # outside of the recorded history (e.g. no capture time), best effort
+            pose = self._gimbal.measure_deg()
+        return pose
+
+    def _image_error(self, bbox: BoundingBox) -> Tuple[float, float]:
+        """(x, y) pixel error of the detection from the image center."""
+        cx, cy = bbox.center()
+        return cx * self._width - self._width / 2.0, cy * self._height - self._height / 2.0
+
+    def target_bearing(self, bbox: BoundingBox) -> Tuple[float, float]:
+        """Absolute (tilt, pan) of the target, from the gimbal angles at capture time."""
+        error_x, error_y = self._image_error(bbox)
+        capture_tilt, capture_pan = self._capture_pose(bbox)
+        return capture_tilt - error_y * self._deg_per_px, capture_pan + error_x * self._deg_per_px
+
+    def _setpoint(self, bbox: BoundingBox) -> Tuple[float, float]:
+        error_x, error_y = self._image_error(bbox)
+        delta_pan = error_x * self._k_p_pan
+        delta_tilt = -error_y * self._k_p_tilt
+
+        capture_tilt, capture_pan = self._capture_pose(bbox)
+        return capture_tilt + delta_tilt, capture_pan + delta_pan
+
+    def _velocity(self) -> Tuple[float, float]:
+        """Least squares angular velocity (tilt, pan) over the recent bearings, in deg/s."""
+        if len(self._bearings) < 2:
+            return 0.0, 0.0
+        last_t = self._bearings[-1][0]
+        recent = [b for b in self._bearings if last_t - b[0] <= 0.5]
+        if len(recent) < 2:
+            return 0.0, 0.0
+
+        n = len(recent)
+        mean_t = sum(b[0] for b in recent) / n
+        var_t = sum((b[0] - mean_t) ** 2 for b in recent)
+        if var_t <= 0:
+            return 0.0, 0.0
+        limit = self._reacquisition.max_coast_velocity_dps
+        velocity = []
+        for axis in (1, 2):
+            mean = sum(b[axis] for b in recent) / n
+            v = sum((b[0] - mean_t) * (b[axis] - mean) for b in recent) / var_t
+            velocity.append(max(-limit, min(limit, v)))
+        return velocity[0], velocity[1]
+
+    def _predicted(self, now: float) -> Tuple[float, float]:
+        """Where the lost target is expected, following the last velocity for at most coast_s."""
+        t, tilt, pan = self._bearings[-1]
+        dt = min(now - t, self._reacquisition.loss_timeout_s + self._reacquisition.coast_s)
+        tilt += self._coast_velocity[0] * dt
+        pan += self._coast_velocity[1] * dt
+        return (max(TILT_RANGE[0], min(TILT_RANGE[1], tilt)),
+                max(PAN_RANGE[0], min(PAN_RANGE[1], pan)))
+
+    def _search_radius(self) -> float:
+        return self._reacquisition.search_spacing_deg * self._search_phase / (2 * math.pi)
+
+    def _search_point(self) -> Tuple[float, float]:
+        radius = self._search_radius()
+        return (self._search_center[0] + radius * math.sin(self._search_phase),
+                self._search_center[1] + radius * math.cos(self._search_phase))
+
+    def _compatible(self, bearing: Tuple[float, float], now: float) -> bool:
+        cfg = self._reacquisition
+        predicted = self._predicted(now)
+        # the prediction gets less certain the longer the target is gone, but not without bound,
+        # otherwise anything in the gimbal range would pass after a couple of seconds
+        gate = min(cfg.gate_deg + cfg.gate_growth_dps * (now - self._bearings[-1][0]), cfg.max_gate_deg)
+        if math.dist(bearing, predicted) <= gate:
+            return True
+        # the search finds the target where the camera is looking, not anywhere in the searched area
+        return self._state == "searching" and math.dist(bearing, self._search_point()) <= gate
+
+    def _on_bbox(self, bbox: BoundingBox, now: float):
+        bearing = self.target_bearing(bbox)
+        t = bbox.capture_time_s if bbox.capture_time_s > 0 else now
+
+        with self._lock:
+            if not self._active:
+                return
+            if self._state in ("coasting", "searching"):
+                if not self._compatible(bearing, now):
+                    return
+                self._reacquire_times_s.append(now - self._lost_at)
+                logger.info(f"Target reacquired after {now - self._lost_at:.2f}s ({self._state})")
+            self._set_state("tracking")
+            self._bearings.append((t, *bearing))
+
+        new_tilt, new_pan = self._setpoint(bbox)
+        self._move_to(new_tilt, new_pan)
+
+    def _move_to(self, tilt: float, pan: float):
+        # clamp ranges
+        tilt = max(TILT_RANGE[0], min(TILT_RANGE[1], tilt))
+        pan = max(PAN_RANGE[0], min(PAN_RANGE[1], pan))
+        self._trajectory.move_to(tilt, pan)
+
+    def _on_no_detection(self, now: float):
+        cfg = self._reacquisition
+        with self._lock:
+            if not self._active or self._state == "idle" or not self._bearings:
+                return
+            lost_for = now - self._bearings[-1][0]
+
+            if self._state == "tracking":
+                if lost_for < cfg.loss_timeout_s:
+                    return
+                self._losses += 1
+                self._set_state("coasting")
+                # reacquisition times count from here, not including the loss timeout
+                self._lost_at = now
+                self._coast_velocity = self._velocity()
+                logger.info(f"Target lost, coasting at {self._coast_velocity} deg/s")
+
+            if self._state == "coasting":
+                if lost_for < cfg.loss_timeout_s + cfg.coast_s:
+                    target = self._predicted(now)
+                else:
+                    self._set_state("searching")
+                    self._search_center = self._predicted(now)
+                    self._search_phase = 0.0
+                    self._search_updated_at = now
+                    target = self._search_center
+            elif self._state == "searching":
+                if lost_for > cfg.loss_timeout_s + cfg.coast_s + cfg.search_s:
+                    self._set_state("idle")
+                    logger.info("Target not reacquired, search stopped")
+                    return
+                # Archimedean spiral with a constant speed along the path
+                radius = max(self._search_radius(), cfg.search_spacing_deg / 2)
+                self._search_phase += cfg.search_speed_dps * (now - self._search_updated_at) / radius
+                self._search_updated_at = now
+                target = self._search_point()
+            else:
+                return
+
+        self._move_to(*target)
+
     def _worker(self):
         # consume latest detection from the queue and apply control
         while not self._stop_event.is_set():
             try:
-                center = self._queue.get(timeout=0.1)
+                bbox = self._queue.get(timeout=0.02)
             except queue.Empty:
-                continue
+                bbox = None
 
-            if center:
-                try:
-                    cx, cy = center
-                    error_x = cx * self._width - self._width / 2.0
-                    error_y = cy * self._height - self._height / 2.0
-
-                    delta_pan = error_x * self._k_p
-                    delta_tilt = -error_y * self._k_p
-
-                    current_tilt, current_pan = self._gimbal.measure_deg()
-                    # time.sleep(0.01)
-                    new_tilt = current_tilt + delta_tilt
-                    new_pan = current_pan + delta_pan
-
-                    # clamp ranges
-                    new_tilt = max(0.0, min(90.0, new_tilt))
-                    new_pan = max(-45.0, min(45.0, new_pan))
+            try:
+                self.step(bbox, time.monotonic())
+            except Exception as e:
+                logger.error(f"Tracking worker error: {e}")
 
-                    self._gimbal.move_deg(new_tilt, new_pan)
-                    # time.sleep(0.01)
-                except Exception as e:
-                    logger.error(f"Tracking worker error: {e}")
+    def step(self, bbox: Optional[BoundingBox], now: float):
+        """Handle one detection, or the absence of one, at time now."""
+        if bbox:
+            self._on_bbox(bbox, now)
+        else:
+            self._on_no_detection(now)
 
     def stop(self, timeout: Optional[float] = 1.0):
         self._stop_event.set()
-        self._thread.join(timeout)
+        if self._thread:
+            self._thread.join(timeout)
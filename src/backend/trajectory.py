@@ -0,0 +1,202 @@
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Tuple
+
+from gimbal import GimbalSerial
+from pose_history import PoseHistory
+
+logger = logging.getLogger(__name__)
+
+class _Axis:
+    """
+    Jerk, acceleration and velocity limited motion of one axis towards a target.
+    """
+
+    def __init__(self, position: float, max_vel: float, max_acc: float, max_jerk: float):
+        self.position = position
+        self.velocity = 0.0
+        self.acceleration = 0.0
+        self.target = position
+        self._max_vel = max_vel
+        self._max_acc = max_acc
+        self._max_jerk = max_jerk
+
+    def reset(self, position: float):
+        self.position = position
+        self.target = position
+        self.velocity = 0.0
+        self.acceleration = 0.0
+
+    def at_rest(self) -> bool:
+        return self.position == self.target and self.velocity == 0.0
+
+    def step(self, dt: float):
+        error = self.target - self.position
+
+        if abs(error) < 1e-3 and abs(self.velocity) < self._max_acc * dt:
+            self.reset(self.target)
+            return
+
+        # acceleration can only follow the desired acceleration as fast as the jerk limit allows,
+        # so the velocity loop is kept slower than that (otherwise it limit-cycles around the target)
+        k_vel = self._max_jerk / self._max_acc
+        k_pos = 0.3 * k_vel
+
+        # fastest speed from which we can still brake before the target, linear close to the target
+        desired_vel = min(self._max_vel, (2.0 * 0.7 * self._max_acc * abs(error)) ** 0.5, k_pos * abs(error))
+        desired_vel = desired_vel if error > 0 else -desired_vel
+
+        desired_acc = k_vel * (desired_vel - self.velocity)
+        desired_acc = max(-self._max_acc, min(self._max_acc, desired_acc))
+
+        max_delta_acc = self._max_jerk * dt
+        self.acceleration += max(-max_delta_acc, min(max_delta_acc, desired_acc - self.acceleration))
+
+        self.velocity = max(-self._max_vel, min(self._max_vel, self.velocity + self.acceleration * dt))
+        self.position += self.velocity * dt
+
+class TrajectoryGenerator:
+    """
+    Sits between callers and GimbalSerial.move_deg and streams smooth setpoints to the gimbal
+    at a fixed rate, instead of letting the servos slew to a far away setpoint at full speed.
+
+    move_to() can be called at any time, including mid-motion: the profile continues from the
+    current position, velocity and acceleration towards the new target, so frequent tracking
+    corrections blend into the motion rather than restarting it.
+
+    Every setpoint sent is recorded in pose_history, and the measured angles are sampled into it
+    every measure_every ticks, whether the gimbal is moving or not.
+    """
+
+    def __init__(self, gimbal: GimbalSerial, pose_history: PoseHistory | None = None, rate_hz: float = 100.0,
+                 max_vel_dps: float = 180.0, max_acc_dps2: float = 720.0, max_jerk_dps3: float = 7200.0,
+                 measure_every: int = 2, name: str = "trajectory"):
+        self._gimbal = gimbal
+        self._pose_history = pose_history
+        self._measure_every = measure_every
+        self._dt = 1.0 / rate_hz
+
+        # a gimbal that doesn't answer must not take the other units down with it
+        try:
+            tilt, pan = gimbal.measure_deg()
+            self._synced = True
+        except Exception as e:
+            logger.warning(f"Couldn't read the gimbal position, assuming (0, 0) until it answers: {e}")
+            tilt, pan = 0.0, 0.0
+            self._synced = False
+        self._next_sync_attempt = 0.0
+        self._tilt = _Axis(tilt, max_vel_dps, max_acc_dps2, max_jerk_dps3)
+        self._pan = _Axis(pan, max_vel_dps, max_acc_dps2, max_jerk_dps3)
+
+        self._lock = threading.Lock()
+        self._suspended = False
+        self._stop_event = threading.Event()
+
+        self._thread = threading.Thread(target=self._worker, name=name, daemon=True)
+        self._thread.start()
+
+    def move_to(self, tilt: float, pan: float):
+        """Re-target the motion. Angles are clamped to the gimbal range."""
+        with self._lock:
+            self._tilt.target = max(0.0, min(90.0, float(tilt)))
+            self._pan.target = max(-45.0, min(45.0, float(pan)))
+
+    def target(self) -> Tuple[float, float]:
+        with self._lock:
+            return self._tilt.target, self._pan.target
+
+    def setpoint(self) -> Tuple[float, float]:
+        """The last setpoint sent to the gimbal."""
+        with self._lock:
+            return self._tilt.position, self._pan.position
+
+    def _resync(self):
+        tilt, pan = self._gimbal.measure_deg()
+        with self._lock:
+            self._tilt.reset(tilt)
+            self._pan.reset(pan)
+        self._synced = True
+
+    def _try_initial_sync(self):
+        """Take the first successful measurement as the start of the profile, keeping the targets."""
+        now = time.monotonic()
+        if now < self._next_sync_attempt:
+            return
+        self._next_sync_attempt = now + 1.0
+        try:
+            tilt, pan = self._gimbal.measure_deg()
+        except Exception:
+            return
+        with self._lock:
+            for axis, position in ((self._tilt, tilt), (self._pan, pan)):
+                target = axis.target
+                axis.reset(position)
+                axis.target = target
+        self._synced = True
+        logger.info(f"Gimbal answered, resynced at ({tilt:.1f}, {pan:.1f})")
+
+    @contextmanager
+    def suspended(self):
+        """
+        Stop streaming setpoints while something else drives the gimbal directly (e.g. auto-tune).
+        The profile restarts from the measured position afterwards.
+        """
+        with self._lock:
+            self._suspended = True
+        try:
+            yield
+        finally:
+            try:
+                self._resync()
+            except Exception as e:
+                logger.error(f"Trajectory resync failed: {e}")
+            with self._lock:
+                self._suspended = False
+
+    def _measure(self):
+        before = time.monotonic()
+        tilt, pan = self._gimbal.measure_deg()
+        after = time.monotonic()
+        # the reading was taken somewhere during the round trip
+        self._pose_history.record_measured((before + after) / 2.0, tilt, pan)
+
+    def _worker(self):
+        next_tick = time.monotonic()
+        tick = 0
+        while not self._stop_event.is_set():
+            next_tick += self._dt
+            tick += 1
+            setpoint = None
+
+            if not self._synced:
+                self._try_initial_sync()
+
+            with self._lock:
+                suspended = self._suspended
+                if not suspended and not (self._tilt.at_rest() and self._pan.at_rest()):
+                    self._tilt.step(self._dt)
+                    self._pan.step(self._dt)
+                    setpoint = (self._tilt.position, self._pan.position)
+
+            try:
+                if setpoint is not None:
+                    self._gimbal.move_deg(*setpoint)
+                    if self._pose_history:
+                        self._pose_history.record_commanded(time.monotonic(), *setpoint)
+                if self._pose_history and not suspended and tick % self._measure_every == 0:
+                    self._measure()
+            except Exception as e:
+                logger.error(f"Trajectory worker error: {e}")
+
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # fell behind (e.g. slow serial), don't try to catch up with a burst of packets
+                next_tick = time.monotonic()
+
+    def stop(self, timeout: float | None = 1.0):
+        self._stop_event.set()
+        self._thread.join(timeout)
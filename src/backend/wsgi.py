@@ -11,11 +11,21 @@ flask_logger.setLevel(logging.WARN)
 logger.info("Starting backend.....")
 
 import os
-from flask import Flask, jsonify, request, send_from_directory
+import threading
+from flask import Flask, Response, jsonify, request, send_from_directory, send_file
 from flask_cors import CORS
+from errors import InvalidRequest, NotFound
 from state_management import StateManagement
+from export_jobs import ExportQueue
+from recordings import list_recordings
+from thumbnails import ThumbnailService
+from profiler import ThreadMonitor, register_queue, sample_stacks, collapsed, sample_process
 
 state_management = StateManagement()
+export_queue = ExportQueue()
+thumbnail_service = ThumbnailService()
+thread_monitor = ThreadMonitor()
+register_queue("exports", export_queue.pending)
 app = Flask(__name__)
 CORS(app)
 FRONTEND_DIR = "../frontend"
@@ -23,15 +33,40 @@ FRONTEND_DIR = "../frontend"
 if not os.path.isdir(FRONTEND_DIR):
     logger.warning(f"FRONTEND_DIR does not exist.")
 
+@app.errorhandler(NotFound)
+def not_found(e):
+    return jsonify({"error": str(e)}), 404
+
+@app.errorhandler(InvalidRequest)
+def invalid_request(e):
+    return jsonify({"error": str(e)}), 400
+
+@app.post("/api/units")
+def get_units():
+    return jsonify(state_management.units())
+
 @app.post("/api/status")
 def get_status():
-    return jsonify(state_management.status())
+    data = request.get_json(silent=True) or {}
+    return jsonify(state_management.status(data.get("unit")))
+
+@app.post("/api/h264_preview")
+def h264_preview_info():
+    data = request.get_json(silent=True) or {}
+    return jsonify(state_management.h264_preview_info(data.get("unit")))
+
+@app.get("/api/h264_preview/<unit>/stream.mp4")
+def h264_preview_stream(unit):
+    # a fragmented MP4 that never ends, appended to a MediaSource by the browser as it arrives
+    response = Response(state_management.h264_preview_stream(unit), mimetype="video/mp4")
+    response.headers["Cache-Control"] = "no-store"
+    return response
 
 @app.post("/api/manual_move")
 def manual_move():
     data = request.get_json()
     direction = data.get("direction")
-    state_management.manual_move(direction)
+    state_management.manual_move(direction, data.get("unit"))
     return jsonify({})
 
 @app.post("/api/manual_move_to")
@@ -39,9 +74,24 @@ def manual_move_to():
     data = request.get_json()
     tilt = data.get("tilt")
     pan = data.get("pan")
-    state_management.manual_move_to(tilt, pan)
+    state_management.manual_move_to(tilt, pan, data.get("unit"))
     return jsonify({})
 
+@app.post("/api/autotune")
+def autotune():
+    data = request.get_json(silent=True) or {}
+    return jsonify({"started": state_management.autotune(data.get("unit"))})
+
+@app.post("/api/autotune_status")
+def autotune_status():
+    data = request.get_json(silent=True) or {}
+    return jsonify(state_management.autotune_status(data.get("unit")))
+
+@app.post("/api/autotune_cancel")
+def autotune_cancel():
+    data = request.get_json(silent=True) or {}
+    return jsonify({"canceled": state_management.cancel_autotune(data.get("unit"))})
+
 @app.post("/api/arm")
 def arm():
     state_management.arm()
@@ -52,6 +102,113 @@ def disarm():
     state_management.disarm()
     return jsonify({})
 
+@app.post("/api/recordings")
+def recordings():
+    return jsonify(list_recordings())
+
+@app.post("/api/exports")
+def exports():
+    return jsonify(export_queue.jobs())
+
+@app.post("/api/export")
+def export():
+    data = request.get_json()
+    job = export_queue.submit(
+        recording=data.get("recording"),
+        rotation=int(data.get("rotation", 90)),
+        format=data.get("format", "mp4"),
+        start_s=float(data.get("start_s") or 0.0),
+        end_s=None if data.get("end_s") is None else float(data.get("end_s")),
+    )
+    return jsonify(export_queue.status(job.id))
+
+@app.post("/api/export_status")
+def export_status():
+    data = request.get_json()
+    return jsonify(export_queue.status(data.get("id")))
+
+@app.post("/api/export_cancel")
+def export_cancel():
+    data = request.get_json()
+    export_queue.cancel(data.get("id"))
+    return jsonify(export_queue.status(data.get("id")))
+
+@app.post("/api/export_resume")
+def export_resume():
+    data = request.get_json()
+    export_queue.resume(data.get("id"))
+    return jsonify(export_queue.status(data.get("id")))
+
+@app.get("/api/export_download/<job_id>")
+def export_download(job_id):
+    return send_file(export_queue.output_path(job_id), as_attachment=True)
+
+def _cached_jpeg(etag: str, generate):
+    # thumbnails never change for a given ETag, so revalidation skips generating them entirely
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(generate(), mimetype="image/jpeg")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.get("/api/recordings/<name>/thumbnail")
+def recording_thumbnail(name):
+    t_s = request.args.get("t", 0.0, type=float)
+    width = request.args.get("width", 160, type=int)
+    return _cached_jpeg(thumbnail_service.etag(name, "thumb", t_s, width),
+                        lambda: thumbnail_service.thumbnail(name, t_s, width))
+
+@app.get("/api/recordings/<name>/strip")
+def recording_strip(name):
+    args = (
+        request.args.get("mode", "interval"),
+        request.args.get("start", 0.0, type=float),
+        request.args.get("interval", 10.0, type=float),
+        request.args.get("count", 10, type=int),
+        request.args.get("width", 160, type=int),
+    )
+    return _cached_jpeg(thumbnail_service.etag(name, "strip", *args),
+                        lambda: thumbnail_service.strip(name, *args))
+
+@app.post("/api/admin/threads")
+def admin_threads():
+    return jsonify(thread_monitor.snapshot())
+
+@app.post("/api/admin/profile")
+def admin_profile():
+    """
+    Samples the stacks of all backend threads for `seconds` and returns them in collapsed stack
+    format (one "thread;frame;...;frame count" line per stack), ready for a flamegraph tool.
+    With "cv": true the cv process is sampled with py-spy at the same time.
+    """
+    data = request.get_json(silent=True) or {}
+    seconds = float(data.get("seconds", 5.0))
+    interval_s = float(data.get("interval_ms", 5.0)) / 1000
+    if not 0 < seconds <= 60:
+        raise InvalidRequest("seconds must be between 0 and 60")
+    # a shorter interval would keep the sampler spinning on the GIL and stall the server
+    if not 0.001 <= interval_s <= 1.0:
+        raise InvalidRequest("interval_ms must be between 1 and 1000")
+
+    cv_result = {}
+    cv_thread = None
+    if data.get("cv"):
+        def run_cv():
+            try:
+                cv_result["stacks"] = sample_process(state_management.cv_pid, seconds)
+            except Exception as e:
+                cv_result["error"] = str(e)
+        cv_thread = threading.Thread(target=run_cv, name="profile-cv", daemon=True)
+        cv_thread.start()
+
+    stacks = collapsed(sample_stacks(seconds, interval_s))
+    if cv_thread:
+        cv_thread.join()
+
+    return jsonify({"backend": stacks, "cv": cv_result or None})
+
 @app.route("/", defaults={"path": ""})
 @app.route("/<path:path>")
 def serve_frontend(path):
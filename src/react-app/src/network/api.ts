@@ -16,6 +16,39 @@ export type StatusResponse = {
   bbox: BoundingBox;
 };
 
+export type H264PreviewInfo = {
+  enabled: boolean;
+  /** RFC 6381 codec string for MediaSource.addSourceBuffer, null until the stream started */
+  codec: string | null;
+  viewers: number;
+};
+
+export type Recording = {
+  name: string;
+  unit: string;
+  session: string;
+  size: number;
+  modified: number;
+  active: boolean;
+};
+
+export type ExportFormat = "mp4" | "mkv" | "webm";
+
+export type ExportJob = {
+  id: string;
+  recording: string;
+  rotation: 0 | 90 | 180 | 270;
+  format: ExportFormat;
+  start_s: number;
+  end_s: number | null;
+  state: "queued" | "running" | "done" | "failed" | "canceled";
+  progress: number;
+  error: string | null;
+  created_at: number;
+  chunks_done: number;
+  output: string | null;
+};
+
 export type ApiResponse<T = Record<string, unknown>> = T;
 
 /**
@@ -140,6 +173,115 @@ export class ApiClient {
   async disarm(): Promise<ApiResponse> {
     return this.post<ApiResponse>("/api/disarm");
   }
+
+  /**
+   * Lists the recordings, newest first
+   * @returns Promise resolving to the recordings
+   */
+  async getRecordings(): Promise<ApiResponse<Recording[]>> {
+    return this.post<ApiResponse<Recording[]>>("/api/recordings");
+  }
+
+  /**
+   * Lists all export jobs
+   * @returns Promise resolving to the export jobs
+   */
+  async getExports(): Promise<ApiResponse<ExportJob[]>> {
+    return this.post<ApiResponse<ExportJob[]>>("/api/exports");
+  }
+
+  /**
+   * Queues an export of a finished recording
+   * @param recording - The recording file name
+   * @param options - Rotation, format and trim range (seconds) of the export
+   * @returns Promise resolving to the new export job
+   */
+  async createExport(
+    recording: string,
+    options: {
+      rotation?: 0 | 90 | 180 | 270;
+      format?: ExportFormat;
+      start_s?: number;
+      end_s?: number;
+    } = {},
+  ): Promise<ApiResponse<ExportJob>> {
+    return this.post<ApiResponse<ExportJob>>("/api/export", {
+      recording,
+      ...options,
+    });
+  }
+
+  /**
+   * Gets the status of an export job, meant to be polled
+   * @param id - The export job id
+   * @returns Promise resolving to the export job
+   */
+  async getExportStatus(id: string): Promise<ApiResponse<ExportJob>> {
+    return this.post<ApiResponse<ExportJob>>("/api/export_status", { id });
+  }
+
+  /**
+   * Cancels an export job, it can be resumed later
+   * @param id - The export job id
+   * @returns Promise resolving to the export job
+   */
+  async cancelExport(id: string): Promise<ApiResponse<ExportJob>> {
+    return this.post<ApiResponse<ExportJob>>("/api/export_cancel", { id });
+  }
+
+  /**
+   * Resumes a canceled or failed export job
+   * @param id - The export job id
+   * @returns Promise resolving to the export job
+   */
+  async resumeExport(id: string): Promise<ApiResponse<ExportJob>> {
+    return this.post<ApiResponse<ExportJob>>("/api/export_resume", { id });
+  }
+
+  /**
+   * Gets whether the low bitrate H.264 preview is enabled for a unit, and its codec
+   * @param unit - The unit name, defaults to the first unit
+   */
+  async getH264PreviewInfo(unit?: string): Promise<ApiResponse<H264PreviewInfo>> {
+    return this.post<ApiResponse<H264PreviewInfo>>("/api/h264_preview", { unit });
+  }
+
+  /**
+   * URL of the fragmented MP4 H.264 preview of a unit, to be fetched as a stream and appended
+   * to a MediaSource SourceBuffer as the chunks arrive
+   */
+  h264PreviewUrl(unit: string): string {
+    return `${this.baseUrl}/api/h264_preview/${encodeURIComponent(unit)}/stream.mp4`;
+  }
+
+  exportDownloadUrl(id: string): string {
+    return `${this.baseUrl}/api/export_download/${id}`;
+  }
+
+  thumbnailUrl(recording: string, t: number, width: number = 160): string {
+    return `${this.baseUrl}/api/recordings/${encodeURIComponent(recording)}/thumbnail?t=${t}&width=${width}`;
+  }
+
+  /**
+   * URL of a horizontal sprite of thumbnails, each `width` pixels wide
+   * @param mode - "interval" for a thumbnail every `interval` seconds, "events" for detection events
+   */
+  stripUrl(
+    recording: string,
+    options: {
+      mode?: "interval" | "events";
+      start?: number;
+      interval?: number;
+      count?: number;
+      width?: number;
+    } = {},
+  ): string {
+    const params = new URLSearchParams(
+      Object.entries(options).map(([key, value]) => [key, String(value)]),
+    );
+
+    return `${this.baseUrl}/api/recordings/${encodeURIComponent(recording)}/strip?${params}`;
+  }
 }
 
 // Export a default instance
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the backend is run from its own directory and imports its modules by name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src", "backend"))
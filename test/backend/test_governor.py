@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+from cv_process.governor import Governor, LEVELS
+
+class FakeSysfs:
+    """A thermal zone and /proc/stat below a temporary root, as the governor reads them."""
+
+    def __init__(self, root):
+        self.root = str(root)
+        self._zone = os.path.join(self.root, "sys", "class", "thermal", "thermal_zone0")
+        os.makedirs(self._zone)
+        os.makedirs(os.path.join(self.root, "proc"))
+        with open(os.path.join(self._zone, "type"), "w") as f:
+            f.write("CPU-therm\n")
+        self._busy = self._idle = 0
+        self.set_temp(60.0)
+
+    def set_temp(self, temp_c: float):
+        with open(os.path.join(self._zone, "temp"), "w") as f:
+            f.write(f"{int(temp_c * 1000)}\n")
+
+    def tick_cpu(self, load: float):
+        """Advance the CPU counters by 100 jiffies at the given load."""
+        self._busy += round(100 * load)
+        self._idle += 100 - round(100 * load)
+        with open(os.path.join(self.root, "proc", "stat"), "w") as f:
+            f.write(f"cpu  {self._busy} 0 0 {self._idle} 0 0 0 0 0 0\n")
+
+@pytest.fixture
+def sysfs(tmp_path):
+    return FakeSysfs(tmp_path)
+
+def run(governor: Governor, sysfs: FakeSysfs, start: float, seconds: int, temp_c: float,
+        load: float = 0.5, fps: float = 60.0) -> float:
+    """Call update() once a second for seconds at the given readings. Returns the time reached."""
+    sysfs.set_temp(temp_c)
+    t = start
+    for _ in range(seconds):
+        sysfs.tick_cpu(load)
+        governor.update(fps=fps, now=t)
+        t += 1.0
+    return t
+
+def test_steps_down_at_the_hot_threshold(sysfs):
+    applied = []
+    governor = Governor(applied.append, root=sysfs.root)
+
+    t = run(governor, sysfs, 0.0, 60, temp_c=79.9)
+    assert governor.level == 0
+
+    # needs the pressure for down_after_s (3 s) before stepping
+    t = run(governor, sysfs, t, 3, temp_c=80.0)
+    assert governor.level == 0
+    run(governor, sysfs, t, 1, temp_c=80.0)
+    assert governor.level == 1
+    assert applied == [LEVELS[1]]
+
+def test_holds_between_steps_and_keeps_stepping_down_under_pressure(sysfs):
+    steps = []
+    governor = Governor(lambda level: steps.append((t, LEVELS.index(level))), root=sysfs.root)
+
+    sysfs.set_temp(85.0)
+    for t in range(60):
+        sysfs.tick_cpu(0.5)
+        governor.update(fps=60.0, now=float(t))
+    # the first step after down_after_s (3 s), then one every hold_s (10 s), down to the last level
+    assert steps == [(3, 1), (13, 2), (23, 3), (33, 4)]
+
+def test_holds_level_inside_the_hysteresis_band(sysfs):
+    governor = Governor(lambda level: None, root=sysfs.root)
+    t = run(governor, sysfs, 0.0, 5, temp_c=85.0)
+    assert governor.level == 1
+
+    # below hot_c but above cool_c: neither pressure nor headroom
+    run(governor, sysfs, t, 300, temp_c=76.0)
+    assert governor.level == 1
+
+def test_steps_back_up_after_cooling(sysfs):
+    applied = []
+    governor = Governor(applied.append, root=sysfs.root)
+    t = run(governor, sysfs, 0.0, 5, temp_c=85.0)
+    assert governor.level == 1
+
+    # up_after_s (30 s) of headroom below cool_c
+    t = run(governor, sysfs, t, 29, temp_c=70.0)
+    assert governor.level == 1
+    run(governor, sysfs, t, 2, temp_c=70.0)
+    assert governor.level == 0
+    assert applied == [LEVELS[1], LEVELS[0]]
+
+def test_cpu_load_and_frame_rate_are_pressure_too(sysfs):
+    governor = Governor(lambda level: None, root=sysfs.root)
+    run(governor, sysfs, 0.0, 5, temp_c=60.0, load=0.95)
+    assert governor.level == 1
+
+    governor = Governor(lambda level: None, root=sysfs.root)
+    run(governor, sysfs, 0.0, 5, temp_c=60.0, fps=45.0)
+    assert governor.level == 1
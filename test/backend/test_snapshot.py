@@ -0,0 +1,102 @@
+import threading
+import time
+
+from cv_process.ipc import BoundingBox
+from snapshot import MAX_BBOXES, SnapshotPublisher
+
+DURATION_S = 2.0
+READERS = 8
+
+def run_concurrently(writers, reader, duration_s: float = DURATION_S, readers: int = READERS):
+    stop = threading.Event()
+    threads = [threading.Thread(target=w, args=(stop,)) for w in writers]
+    threads += [threading.Thread(target=reader, args=(stop,)) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(duration_s)
+    stop.set()
+    for t in threads:
+        t.join()
+
+def test_readers_see_every_field_from_one_generation():
+    """A writer publishes all fields at once from a generation number; readers never see a mix."""
+    publisher = SnapshotPublisher()
+    errors = []
+    reads = []
+
+    def write(stop):
+        i = 0
+        while not stop.is_set():
+            i += 1
+            publisher.publish(armed=i % 2 == 0, angles=(float(i), float(-i)), angles_time=float(i),
+                              frame=str(i), frame_time=float(i), frame_seq=i)
+
+    def read(stop):
+        n = 0
+        last_seq = 0
+        while not stop.is_set():
+            s = publisher.current
+            n += 1
+            if s.seq < last_seq:
+                errors.append(f"seq went backwards: {last_seq} -> {s.seq}")
+            last_seq = s.seq
+            if s.frame is None:
+                continue
+            generation = s.frame_seq
+            fields = (s.armed, s.angles, s.angles_time, s.frame, s.frame_time)
+            expected = (generation % 2 == 0, (float(generation), float(-generation)), float(generation),
+                        str(generation), float(generation))
+            if fields != expected:
+                errors.append(f"torn snapshot: {fields} at generation {generation}")
+        reads.append(n)
+
+    run_concurrently([write], read)
+    assert not errors, errors[:10]
+    assert publisher.current.seq > 1000
+    assert sum(reads) > 1000
+
+def test_concurrent_writers_of_different_fields():
+    """
+    Writers of different fields keep an invariant between the fields they write (angles sum to zero,
+    the frame payload is its sequence number, the bboxes are consecutive), so a torn or lost update
+    shows up in the readers.
+    """
+    publisher = SnapshotPublisher()
+    errors = []
+
+    def write_angles(stop):
+        i = 0
+        while not stop.is_set():
+            i += 1
+            publisher.set_angles(time.monotonic(), float(i), float(-i))
+
+    def write_frames(stop):
+        while not stop.is_set():
+            publisher.set_frame(str(publisher.current.frame_seq + 1), time.time())
+
+    def write_bboxes(stop):
+        i = 0
+        while not stop.is_set():
+            i += 1
+            publisher.add_bbox(BoundingBox(pts_s=float(i), conf=0.5, left=0, top=0, width=0, height=0))
+
+    def write_armed(stop):
+        while not stop.is_set():
+            publisher.set_armed(not publisher.current.armed)
+
+    def read(stop):
+        while not stop.is_set():
+            s = publisher.current
+            if s.angles is not None and s.angles[0] != -s.angles[1]:
+                errors.append(f"torn angles: {s.angles}")
+            if s.frame is not None and int(s.frame) != s.frame_seq:
+                errors.append(f"frame {s.frame} doesn't match frame_seq {s.frame_seq}")
+            pts = [b.bbox.pts_s for b in s.bboxes]
+            if len(pts) > MAX_BBOXES or any(b - a != 1.0 for a, b in zip(pts, pts[1:])):
+                errors.append(f"inconsistent bboxes: {pts}")
+            s.bbox_at(time.time())
+
+    run_concurrently([write_angles, write_frames, write_bboxes, write_armed], read)
+    assert not errors, errors[:10]
+    # frames are only ever published by one writer, each from the one before: none were lost
+    assert publisher.current.frame == str(publisher.current.frame_seq)
@@ -0,0 +1,73 @@
+import math
+
+from cv_process.ipc import BoundingBox
+from pose_history import PoseHistory
+from simulator import run_reacquisition_scenario
+from tracking import Tracking, ReacquisitionConfig
+
+DEG_PER_PX = 60.0 / 1920
+
+class FixedGimbal:
+    """Reports whatever pose the test sets, so a centered detection is at exactly that bearing."""
+
+    def __init__(self, tilt: float, pan: float):
+        self.pose = (tilt, pan)
+
+    def measure_deg(self):
+        return self.pose
+
+class RecordingTrajectory:
+    def __init__(self):
+        self.target = None
+
+    def move_to(self, tilt: float, pan: float):
+        self.target = (tilt, pan)
+
+def centered_bbox() -> BoundingBox:
+    return BoundingBox(pts_s=0.0, conf=0.9, left=0.49, top=0.49, width=0.02, height=0.02)
+
+def searching_tracker(search_for_s: float):
+    """A tracker that lost a still target at (45, 0) and has been searching for search_for_s."""
+    gimbal = FixedGimbal(45.0, 0.0)
+    cfg = ReacquisitionConfig()
+    tracking = Tracking(gimbal, RecordingTrajectory(), PoseHistory(), width=1080, height=1920,
+                        k_p=DEG_PER_PX * 0.5, deg_per_px=DEG_PER_PX, reacquisition=cfg, threaded=False)
+    tracking.set_active(True)
+
+    t = 0.0
+    while t < 0.5:
+        tracking.step(centered_bbox(), t)
+        t += 0.02
+    end = t + cfg.loss_timeout_s + cfg.coast_s + search_for_s
+    while t < end:
+        tracking.step(None, t)
+        t += 0.02
+    assert tracking.metrics()["state"] == "searching"
+    return tracking, gimbal, t
+
+def test_search_rejects_detection_far_from_spiral_point():
+    tracking, gimbal, t = searching_tracker(search_for_s=5.0)
+    cfg = ReacquisitionConfig()
+    center = (45.0, 0.0)
+    point = tracking._search_point()
+    radius = math.dist(point, center)
+    assert radius > cfg.max_gate_deg
+
+    # inside the searched area, but on the opposite side from where the camera is looking
+    gimbal.pose = (2 * center[0] - point[0], 2 * center[1] - point[1])
+    tracking.step(centered_bbox(), t)
+    assert tracking.metrics()["state"] == "searching"
+
+def test_search_accepts_detection_at_spiral_point():
+    tracking, gimbal, t = searching_tracker(search_for_s=5.0)
+    gimbal.pose = tracking._search_point()
+    tracking.step(centered_bbox(), t)
+    assert tracking.metrics()["state"] == "tracking"
+    assert tracking.metrics()["reacquisitions"] == 1
+
+def test_reacquisition_scenario():
+    metrics = run_reacquisition_scenario()
+    assert metrics["losses"] == 3
+    assert metrics["reacquisitions"] == 3
+    assert metrics["state"] == "tracking"
+    assert metrics["mean_reacquire_s"] < 2.5